@@ -1,25 +1,90 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import inspect, text
+from routing import RoutingSession, REPLICA_BIND
 
 # Initialize db here
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-def create_app():
+def migrations_pending(app):
+    """True while the database is behind the newest migration, i.e. until `flask db upgrade` has run."""
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    directory = os.path.join(app.root_path, 'migrations')
+    with db.engine.connect() as conn:
+        # Databases made by create_all have no version table and already match the models
+        if not os.path.isdir(directory) or not inspect(conn).has_table('alembic_version'):
+            return False
+        current = set(MigrationContext.configure(conn).get_current_heads())
+    return current != set(ScriptDirectory(directory).get_heads())
+
+def create_app(config=None):
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'your_secret_key_here'  # Replace with your actual secret key
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+    # Background jobs keep their state in a separate database
+    app.config['SQLALCHEMY_BINDS'] = {'jobs': os.environ.get('JOBS_DATABASE_URL', 'sqlite:///jobs.db')}
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Optional read replica for GET requests, e.g. sqlite:///file:database.db?mode=ro&uri=true
+    # or a follower file kept fresh by WAL shipping
+    if os.environ.get('READ_REPLICA_URL'):
+        app.config['SQLALCHEMY_BINDS'][REPLICA_BIND] = os.environ['READ_REPLICA_URL']
+    # Seconds a client keeps reading from the primary after it writes
+    app.config['READ_YOUR_WRITES_SECONDS'] = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+    # User that inherits the projects of deleted users
+    app.config['REASSIGN_OWNER_EMAIL'] = os.environ.get('REASSIGN_OWNER_EMAIL', 'adminuser@example.com')
+    # Threads per worker process that run background jobs
+    app.config['JOBS_MAX_WORKERS'] = int(os.environ.get('JOBS_MAX_WORKERS', 2))
+    # Open /api/events streams per worker process; each holds a thread under gthread, so
+    # under gunicorn post_fork lowers this to the worker's threads minus one
+    app.config['SSE_MAX_SUBSCRIBERS'] = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 100))
+    # Seconds between background ANALYZE/vacuum/checkpoint runs, 0 turns the scheduler off
+    app.config['DB_MAINTENANCE_INTERVAL'] = int(os.environ.get('DB_MAINTENANCE_INTERVAL', 0))
+    # How long a worker must have served no requests before it runs them
+    app.config['DB_MAINTENANCE_IDLE_SECONDS'] = int(os.environ.get('DB_MAINTENANCE_IDLE_SECONDS', 30))
+    # Where `flask backup create` and POST /api/backups write, defaulting to instance/backups, and how many to keep
+    app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR')
+    app.config['BACKUP_KEEP'] = int(os.environ.get('BACKUP_KEEP', 7))
+    # SQLite file archived cohort trees are moved to, instance/archive.db when unset
+    app.config['ARCHIVE_DATABASE'] = os.environ.get('ARCHIVE_DATABASE')
+    # Days deleted rows stay restorable before the purge removes them for good
+    app.config['PURGE_DELETED_AFTER_DAYS'] = float(os.environ.get('PURGE_DELETED_AFTER_DAYS', 7))
+    # Hours a POST's Idempotency-Key is remembered and its response replayed to retries
+    app.config['IDEMPOTENCY_KEY_TTL_HOURS'] = float(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    # Seconds a request holds its key before a retry may take it over; keep it above the worker timeout
+    app.config['IDEMPOTENCY_LEASE_SECONDS'] = float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 60))
+    app.config.update(config or {})  # Overrides, e.g. a scratch database for `flask check-query-budgets`
 
     db.init_app(app)  # Initialize the db with the app
     migrate = Migrate(app, db)  # Initialize Flask-Migrate
 
-    from models import User, Role, Project, Cohort, Class, ProjectMember  # Import models after db is initialized
+    from models import User, Role, Media, Project, Cohort, Class, ProjectMember, ArchivedCohort, ArchivedClass, ArchivedProject, ArchivedProjectMember, StatCounter, ChangeLog, RevokedToken, IdempotencyKey, Job  # Import models after db is initialized
     from routes import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
+    from maintenance import track_activity
+    track_activity(app)  # Lets the maintenance scheduler wait for idle periods
 
     with app.app_context():
+        from archive import attach_archive
+        for bind in (None, REPLICA_BIND):
+            if bind in db.engines:
+                attach_archive(app, db.engines[bind])  # archive.* tables on every connection
         db.create_all()  # Create database tables if they don't exist
+        if REPLICA_BIND in db.engines:
+            # WAL lets replica readers run while the primary is writing
+            db.session.execute(text('PRAGMA journal_mode=WAL'))
+            db.session.commit()
+        if migrations_pending(app):
+            # The triggers and the counter seed need the migrated columns
+            app.logger.warning('Database schema is behind the migrations, run `flask db upgrade` and restart')
+        else:
+            from stats import install_stat_triggers
+            install_stat_triggers()  # Keep the /api/stats counters in step with every write
+            from changes import install_change_triggers
+            install_change_triggers()  # Feed /api/changes from every write
+        import cli  # Register the flask CLI commands on this app
 
     return app
 app = create_app()
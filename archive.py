@@ -0,0 +1,106 @@
+import os
+from sqlalchemy import event, text
+from app import db
+from models import ARCHIVE_SCHEMA, Cohort, Class, Project, ProjectMember
+
+# A cohort's tree, parents first, with the WHERE clause that selects its live rows in a given schema.
+# Tombstoned rows stay behind for the purge.
+TREE = (
+    (Cohort, 'id = :cohort_id AND deleted_at IS NULL'),
+    (Class, 'cohort_id = :cohort_id AND deleted_at IS NULL'),
+    (Project, 'class_id IN (SELECT id FROM {schema}.class WHERE cohort_id = :cohort_id) AND deleted_at IS NULL'),
+    (ProjectMember, 'project_id IN (SELECT id FROM {schema}.project WHERE class_id IN '
+                    '(SELECT id FROM {schema}.class WHERE cohort_id = :cohort_id)) AND deleted_at IS NULL'),
+)
+
+def archive_path(app):
+    return app.config['ARCHIVE_DATABASE'] or os.path.join(app.instance_path, 'archive.db')
+
+def attach_archive(app, engine):
+    """ATTACH the archive file to every new connection of engine, so its tables are reachable as archive.*."""
+    path = archive_path(app)
+
+    @event.listens_for(engine, 'connect')
+    def attach(dbapi_connection, connection_record):
+        dbapi_connection.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+
+def copy_tree(cohort_id, source, target):
+    """INSERT a cohort tree's rows from source into target; returns {table: rows copied}."""
+    params = {'cohort_id': cohort_id}
+    copied = {}
+    for model, where in TREE:
+        table = model.__tablename__
+        # Explicit columns: migrated tables may have them in a different order than the archive copy
+        columns = ', '.join(f'"{column.name}"' for column in model.__table__.columns)
+        copied[table] = db.session.execute(text(
+            f'INSERT INTO {target}."{table}" ({columns}) '
+            f'SELECT {columns} FROM {source}."{table}" WHERE {where.format(schema=source)}'), params).rowcount
+    return copied
+
+def delete_tree(cohort_id, schema):
+    """DELETE a cohort tree's live rows from schema."""
+    # Children first, while the subqueries can still see their parents
+    for model, where in reversed(TREE):
+        db.session.execute(text(f'DELETE FROM {schema}."{model.__tablename__}" WHERE {where.format(schema=schema)}'),
+                           {'cohort_id': cohort_id})
+
+def move_tree(cohort_id, source, target):
+    """Copy a cohort tree from one schema to the other, then delete it from the source.
+
+    SQLite commits a transaction spanning two attached files atomically in
+    rollback-journal mode only, and create_app switches to WAL when a read
+    replica is configured. So the copy is committed into target first and the
+    delete from source in a second transaction: a crash in between leaves the
+    tree in both files, never in neither, and retrying the move then fails on
+    the ids already taken in target. Returns {table: rows moved}. Raises
+    ValueError if the cohort is not in source or any of its rows' ids are
+    already taken in target.
+    """
+    params = {'cohort_id': cohort_id}
+    if db.session.execute(text(f'SELECT 1 FROM {source}.cohort WHERE {TREE[0][1]}'), params).first() is None:
+        raise ValueError(f'Cohort {cohort_id} not found in {source}')
+
+    try:
+        for model, where in TREE:
+            table = model.__tablename__
+            taken = db.session.execute(text(
+                f'SELECT COUNT(*) FROM {target}."{table}" WHERE id IN '
+                f'(SELECT id FROM {source}."{table}" WHERE {where.format(schema=source)})'), params).scalar()
+            if taken:
+                if table == 'cohort':
+                    raise ValueError(f'Cohort {cohort_id} is in both {source} and {target}, e.g. after an '
+                                     f'interrupted move; compare the copies and delete one')
+                raise ValueError(f'{taken} {table} row(s) of cohort {cohort_id} already exist in {target}')
+        moved = copy_tree(cohort_id, source, target)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    try:
+        delete_tree(cohort_id, source)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Take the copy back out so the tree is only in source again; if that fails
+        # too, it stays in both files and the next move reports it
+        try:
+            delete_tree(cohort_id, target)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+        raise
+    return moved
+
+def archive_cohort(cohort_id):
+    """Move a cohort with its classes, projects and members into the archive file.
+
+    The main-file delete triggers keep the stats counters and change log in
+    step, so archived rows drop out of the counters and change feed like
+    deleted ones.
+    """
+    return move_tree(cohort_id, 'main', ARCHIVE_SCHEMA)
+
+def unarchive_cohort(cohort_id):
+    """Move an archived cohort tree back into the main file."""
+    return move_tree(cohort_id, ARCHIVE_SCHEMA, 'main')
@@ -0,0 +1,160 @@
+import datetime
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from flask import current_app
+from app import db
+
+# Pages copied per backup step, and the pause between steps that lets writers in
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_SLEEP = 0.05
+# Times a step-wise copy may be restarted by concurrent writes before it's done in one step
+BACKUP_MAX_RESTARTS = 3
+
+BACKUP_PREFIX = 'database-'
+
+def backup_dir():
+    return current_app.config['BACKUP_DIR'] or os.path.join(current_app.instance_path, 'backups')
+
+def verify(path):
+    """Problems reported by integrity_check on the database file at path; empty when healthy."""
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute('PRAGMA integrity_check') if row[0] != 'ok']
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        conn.close()
+
+class BackupRestarted(Exception):
+    """Raised from the backup progress callback to give up on the step-wise copy."""
+
+def copy_database(source, target, progress=None):
+    """Online copy with the SQLite backup API, a few pages at a time.
+
+    Each step holds the source's read lock only briefly, so writers keep
+    going. But a write through another connection makes SQLite start the
+    whole copy over, so under steady writes it might never finish: after
+    BACKUP_MAX_RESTARTS restarts the copy is done again in a single step,
+    which holds the read lock until it is complete.
+    """
+    restarts = 0
+    last_remaining = last_total = None
+
+    def on_step(status, remaining, total):
+        nonlocal restarts, last_remaining, last_total
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        last_remaining, last_total = remaining, total
+        if progress:
+            progress(total - remaining, total)
+
+    try:
+        source.backup(target, pages=BACKUP_STEP_PAGES, sleep=BACKUP_STEP_SLEEP, progress=on_step)
+    except BackupRestarted:
+        source.backup(target, pages=-1)
+        if progress:
+            progress(last_total, last_total)
+
+def create_backup(compress=True, keep=None, progress=None):
+    """Back up the live database into backup_dir() and rotate old backups.
+
+    The copy is integrity-checked before it is kept. Returns
+    {'path', 'bytes', 'deleted'}; raises RuntimeError if the copy is corrupt.
+    """
+    directory = backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+    name = f'{BACKUP_PREFIX}{stamp}.db' + ('.gz' if compress else '')
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        target = sqlite3.connect(tmp_path)
+        source = db.engine.raw_connection()
+        try:
+            copy_database(source.driver_connection, target, progress)
+        finally:
+            source.close()
+            target.close()
+
+        problems = verify(tmp_path)
+        if problems:
+            raise RuntimeError('Backup copy failed its integrity check: ' + '; '.join(problems[:5]))
+
+        path = os.path.join(directory, name)
+        if compress:
+            with open(tmp_path, 'rb') as raw, gzip.open(path + '.tmp', 'wb', compresslevel=6) as packed:
+                shutil.copyfileobj(raw, packed)
+            os.replace(path + '.tmp', path)
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except Exception:
+        for leftover in (tmp_path, os.path.join(directory, name + '.tmp')):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+
+    keep = current_app.config['BACKUP_KEEP'] if keep is None else keep
+    return {'path': path, 'bytes': os.path.getsize(path), 'deleted': rotate_backups(keep)}
+
+def list_backups():
+    """(name, bytes, created) of every backup in backup_dir(), newest first."""
+    directory = backup_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory)
+                    if name.startswith(BACKUP_PREFIX) and name.endswith(('.db', '.db.gz'))), reverse=True)
+    return [(name, os.path.getsize(os.path.join(directory, name)),
+             datetime.datetime.strptime(name[len(BACKUP_PREFIX):].split('.')[0], '%Y%m%dT%H%M%S%fZ'))
+            for name in names]
+
+def rotate_backups(keep):
+    """Delete all but the newest keep backups, returning the deleted names."""
+    if not keep:
+        return []
+    deleted = [name for name, _, _ in list_backups()[keep:]]
+    for name in deleted:
+        os.remove(os.path.join(backup_dir(), name))
+    return deleted
+
+def restore_backup(path):
+    """Replace the live database's contents with the backup at path.
+
+    The backup is unpacked next to the database and integrity-checked
+    first; a failing backup raises RuntimeError and nothing is touched.
+    The current contents are backed up before they are overwritten, and the
+    copy goes through the backup API so open connections see the new pages
+    instead of a file swapped out from under them.
+    """
+    if not os.path.exists(path):
+        path = os.path.join(backup_dir(), path)
+    live_path = db.engine.url.database
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(live_path), suffix='.restore')
+    os.close(fd)
+    try:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as packed, open(tmp_path, 'wb') as raw:
+            shutil.copyfileobj(packed, raw)
+        problems = verify(tmp_path)
+        if problems:
+            raise RuntimeError('Backup failed its integrity check, nothing restored: ' + '; '.join(problems[:5]))
+
+        safety = create_backup(keep=0)
+        db.session.remove()
+        source = sqlite3.connect(tmp_path)
+        target = db.engine.raw_connection()
+        try:
+            source.backup(target.driver_connection)
+        finally:
+            target.close()
+            source.close()
+        db.engine.dispose()
+    finally:
+        os.remove(tmp_path)
+    return {'restored': path, 'previous': safety['path']}
@@ -0,0 +1,214 @@
+import datetime
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from sqlalchemy import event, insert
+from werkzeug.security import generate_password_hash
+from app import db
+
+# Table sizes the budgets are checked at; a route has to stay within its budget at every one
+DEFAULT_SIZES = (10, 50, 200)
+
+class StatementRecorder:
+    """Collects every statement the calling thread sends to the given engines while active.
+
+    Statements from other threads (the change notifier, job workers) are not counted.
+    """
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+        self.thread = threading.get_ident()
+        self.statements = []
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, 'before_cursor_execute', self.record)
+
+BUDGET_PASSWORD = 'budget-password'
+BUDGET_JOB_ID = 'budget-job'
+
+def seed_dataset(size, admin_email):
+    """size cohorts, classes, students and projects, with members on the first half of the projects."""
+    from models import Role, User, Media, Cohort, Class, Project, ProjectMember, Job
+    from media import digest
+
+    password_hash = generate_password_hash(BUDGET_PASSWORD)
+    db.session.execute(insert(Role), [{'id': 1, 'name': 'admin'}, {'id': 2, 'name': 'student'}])
+    db.session.execute(insert(User), [
+        {'id': 1, 'username': 'budget-admin', 'email': admin_email, 'password_hash': password_hash, 'role_id': 1}
+    ] + [
+        {'id': i + 1, 'username': f'student{i}', 'email': f'student{i}@example.com',
+         'password_hash': password_hash, 'role_id': 2}
+        for i in range(1, size + 1)
+    ])
+    urls = [f'https://example.com/poster{i}.jpg' for i in range(1, 6)]
+    db.session.execute(insert(Media), [{'id': i, 'digest': digest(url), 'url': url} for i, url in enumerate(urls, start=1)])
+    db.session.execute(insert(Cohort), [
+        {'id': i, 'name': f'Cohort {i}', 'description': 'Budget cohort', 'poster_id': i % 5 + 1}
+        for i in range(1, size + 1)
+    ])
+    db.session.execute(insert(Class), [
+        {'id': i, 'name': f'Class {i}', 'description': 'Budget class', 'cohort_id': i, 'poster_id': i % 5 + 1}
+        for i in range(1, size + 1)
+    ])
+    db.session.execute(insert(Project), [
+        {'id': i, 'name': f'Project {i:04d}', 'description': 'A project for the query budget check',
+         'owner_id': i + 1, 'github_link': f'https://github.com/budget/project{i}', 'class_id': i % size + 1,
+         'poster_id': i % 5 + 1}
+        for i in range(1, size + 1)
+    ])
+    db.session.execute(insert(ProjectMember), [
+        {'project_id': i, 'user_id': user_id}
+        for i in range(1, size // 2 + 1) for user_id in {i + 1, i % size + 2}
+    ])
+    now = datetime.datetime.utcnow()
+    db.session.add(Job(id=BUDGET_JOB_ID, kind='export', status='succeeded', result='{}',
+                       result_type='application/json', owner_id=1, created_at=now, updated_at=now))
+    db.session.commit()
+
+def sample_requests(size):
+    """(endpoint, method, path, json body) for every api_bp route, in the order they are run.
+
+    Reads come first and deletes last, so every request finds the rows it needs.
+    """
+    last = size
+    return [
+        ('api.test', 'GET', '/api/test', None),
+        ('api.login', 'POST', '/api/login', {'email': 'student1@example.com', 'password': BUDGET_PASSWORD}),
+        ('api.check_admin', 'GET', '/api/check_admin', None),
+        ('api.get_projects', 'GET', '/api/projects', None),
+        ('api.get_project', 'GET', '/api/projects/1', None),
+        ('api.get_projects_by_class', 'GET', '/api/classes/1/projects', None),
+        ('api.get_cohorts', 'GET', '/api/cohorts', None),
+        ('api.get_classes', 'GET', '/api/classes', None),
+        ('api.get_project_members', 'GET', '/api/project_members', None),
+        ('api.get_members_of_project', 'GET', '/api/projects/1/members', None),
+        ('api.get_projects_of_user', 'GET', '/api/users/2/projects', None),
+        ('api.get_users', 'GET', '/api/users', None),
+        ('api.get_user', 'GET', '/api/users/2', None),
+        ('api.get_media', 'GET', '/api/media?ids=1,2,3', None),
+        ('api.get_stats', 'GET', '/api/stats', None),
+        ('api.get_cohort_stats', 'GET', '/api/stats/cohorts/1', None),
+        ('api.get_class_stats', 'GET', '/api/stats/classes/1', None),
+        ('api.get_project_stats', 'GET', '/api/stats/projects/1', None),
+        ('api.get_changes', 'GET', '/api/changes', None),
+        ('api.get_job', 'GET', f'/api/jobs/{BUDGET_JOB_ID}', None),
+        ('api.get_job_result', 'GET', f'/api/jobs/{BUDGET_JOB_ID}/result', None),
+        ('api.stream_events', 'GET', '/api/events', None),
+        ('api.batch', 'POST', '/api/batch', {'requests': [
+            {'method': 'GET', 'path': '/api/projects/1'}, {'method': 'GET', 'path': '/api/users/2'}]}),
+        ('api.register', 'POST', '/api/register',
+         {'username': 'budget-new', 'email': 'budget-new@example.com', 'password': BUDGET_PASSWORD, 'role_id': 2}),
+        ('api.create_cohort', 'POST', '/api/cohorts', {'name': 'New cohort', 'description': 'Budget cohort',
+                                                        'classes': [{'name': 'New class', 'description': 'x'}]}),
+        ('api.update_cohort', 'PUT', '/api/cohorts/1', {'name': 'Renamed cohort'}),
+        ('api.create_class', 'POST', '/api/classes', {'name': 'New class', 'description': 'Budget class', 'cohort_id': 1}),
+        ('api.create_project', 'POST', '/api/projects', {
+            'name': 'New project', 'description': 'A project for the query budget check', 'owner_id': 2,
+            'class_id': 1, 'github_link': 'https://github.com/budget/new', 'poster_url': 'https://example.com/new.jpg'}),
+        ('api.add_project', 'POST', '/api/classes/1/projects', {
+            'name': 'Another project', 'description': 'A project for the query budget check', 'owner_id': 2,
+            'github_link': 'https://github.com/budget/another', 'poster_url': 'https://example.com/poster1.jpg'}),
+        ('api.update_project', 'PUT', '/api/projects/1', {'name': 'Renamed project'}),
+        ('api.create_project_member', 'POST', '/api/project_members', [
+            {'project_id': last, 'user_id': 2}, {'project_id': last, 'user_id': 3}]),
+        ('api.create_export', 'POST', '/api/exports', {'tables': ['cohorts']}),
+        ('api.create_backup', 'POST', '/api/backups', {}),
+        ('api.get_backups', 'GET', '/api/backups', None),
+        ('api.import_users', 'POST', '/api/users/import', []),
+        ('api.delete_job', 'DELETE', f'/api/jobs/{BUDGET_JOB_ID}', None),
+        ('api.delete_project', 'DELETE', f'/api/projects/{last - 1}', None),
+        ('api.delete_user', 'DELETE', f'/api/users/{last + 1}', None),
+        ('api.delete_cohort', 'DELETE', f'/api/cohorts/{last}', None),
+        ('api.logout', 'POST', '/api/logout', None),
+    ]
+
+def measure(size):
+    """Run every sample request against a fresh database of the given size.
+
+    Returns {endpoint: (status_code, [statement, ...])}. Runs in a forked child,
+    so the per-process caches start out empty just like in a new worker.
+    """
+    import jwt
+    from app import create_app
+    from routes import SECRET_KEY
+    from utils import permission_map
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "budget.db")}',
+            'SQLALCHEMY_BINDS': {'jobs': f'sqlite:///{os.path.join(tmp, "jobs.db")}'},
+            'BACKUP_DIR': os.path.join(tmp, 'backups'),
+            'ARCHIVE_DATABASE': os.path.join(tmp, 'archive.db'),
+        })
+        with app.app_context():
+            seed_dataset(size, app.config['REASSIGN_OWNER_EMAIL'])
+            engines = list(db.engines.values())
+            db.session.remove()
+        permission_map.invalidate()
+
+        token = jwt.encode({'user_id': 1, 'jti': 'budget', 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)},
+                           SECRET_KEY, algorithm='HS256')
+        client = app.test_client()
+        # Per-worker state that every first request pays for (role map, revocation list) is loaded here
+        client.get('/api/check_admin', headers={'Authorization': f'Bearer {token}'})
+
+        for endpoint, method, path, body in sample_requests(size):
+            with StatementRecorder(engines) as recorder:
+                # The key costs the @idempotent routes their claim and store statements, so they're measured with it
+                response = client.open(path, method=method, json=body, headers={
+                    'Authorization': f'Bearer {token}', 'Idempotency-Key': f'budget-{endpoint}'})
+                response.close()
+            results[endpoint] = (response.status_code, recorder.statements)
+    return results
+
+def check_budgets(app, sizes=DEFAULT_SIZES):
+    """Measure every api_bp route at each size and compare against its @query_budget (see utils).
+
+    Returns (report_lines, failures). A route fails when it has no budget or no
+    sample request, errors, exceeds its budget at any size, or runs more
+    statements at each larger size.
+    """
+    sizes = sorted(sizes)
+    runs = {}
+    for size in sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('fork')) as pool:
+            runs[size] = pool.submit(measure, size).result()
+
+    report, failures = [], []
+    endpoints = sorted(endpoint for endpoint in app.view_functions if endpoint.startswith('api.'))
+    for endpoint in endpoints:
+        budget = getattr(app.view_functions[endpoint], 'query_budget', None)
+        if budget is None:
+            failures.append(f'{endpoint}: no @query_budget declared')
+            continue
+        if any(endpoint not in runs[size] for size in sizes):
+            failures.append(f'{endpoint}: no sample request in budgets.sample_requests')
+            continue
+
+        counts = [len(runs[size][endpoint][1]) for size in sizes]
+        report.append(f'{endpoint:32} budget {budget:3}  statements {"/".join(map(str, counts))}')
+        for size in sizes:
+            status, statements = runs[size][endpoint]
+            if status >= 500:
+                failures.append(f'{endpoint}: HTTP {status} at size {size}')
+            elif len(statements) > budget:
+                failures.append(f'{endpoint}: {len(statements)} statements at size {size}, budget is {budget}\n'
+                                + '\n'.join(f'    {statement}' for statement in statements))
+        if len(sizes) > 1 and all(a < b for a, b in zip(counts, counts[1:])):
+            statements = runs[sizes[-1]][endpoint][1]
+            failures.append(f'{endpoint}: statement count grows with table size ({"/".join(map(str, counts))})\n'
+                            + '\n'.join(f'    {statement}' for statement in statements))
+    return report, failures
@@ -0,0 +1,91 @@
+import datetime
+from sqlalchemy import text
+from app import db
+from models import ChangeLog
+from triggers import sync_triggers
+
+# Tables whose writes are logged, and columns that must never leave the database
+TRACKED_TABLES = ('role', 'user', 'cohort', 'class', 'project', 'project_member')
+HIDDEN_COLUMNS = {'user': {'password_hash'}}
+
+def _row_json(table, alias, columns):
+    pairs = ', '.join(f"'{column}', {alias}.{column}" for column in columns)
+    return f'json_object({pairs})'
+
+def _log(table, ref, op, data='NULL'):
+    return (f"INSERT INTO change_log (table_name, row_id, op, data, created_at) "
+            f"VALUES ('{table}', {ref}, '{op}', {data}, CURRENT_TIMESTAMP);")
+
+def change_triggers():
+    """Insert/update/delete triggers for every tracked table, built from its live columns.
+
+    On tables with a deleted_at tombstone, tombstoning a row is logged as its
+    delete and clearing deleted_at as an insert; the purge removing a
+    tombstone later and updates to tombstoned rows are not logged at all.
+    """
+    triggers = {}
+    for table in TRACKED_TABLES:
+        columns = [row[1] for row in db.session.execute(text(f'PRAGMA table_info("{table}")'))
+                   if row[1] not in HIDDEN_COLUMNS.get(table, ())]
+        soft = 'deleted_at' in columns
+        if soft:
+            triggers[f'change_{table}_tombstone'] = (
+                f'AFTER UPDATE OF deleted_at ON "{table}" WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL', [
+                    _log(table, 'OLD.id', 'delete', _row_json(table, 'OLD', columns))])
+            triggers[f'change_{table}_restore'] = (
+                f'AFTER UPDATE OF deleted_at ON "{table}" WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL', [
+                    _log(table, 'NEW.id', 'insert', _row_json(table, 'NEW', columns))])
+        triggers[f'change_{table}_insert'] = (f'AFTER INSERT ON "{table}"', [
+            _log(table, 'NEW.id', 'insert', _row_json(table, 'NEW', columns))])
+        update_when = ' WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NULL' if soft else ''
+        triggers[f'change_{table}_update'] = (f'AFTER UPDATE ON "{table}"{update_when}', [
+            _log(table, 'NEW.id', 'update', _row_json(table, 'NEW', columns))])
+        # Deletes keep the old row too, so subscribers can tell which cohort/class lost it
+        delete_when = ' WHEN OLD.deleted_at IS NULL' if soft else ''
+        triggers[f'change_{table}_delete'] = (f'AFTER DELETE ON "{table}"{delete_when}', [
+            _log(table, 'OLD.id', 'delete', _row_json(table, 'OLD', columns))])
+    return triggers
+
+def install_change_triggers():
+    """Log every write to the tracked tables into change_log, in the writer's own transaction."""
+    sync_triggers('change_', change_triggers())
+    db.session.commit()
+
+def changes_since(since, limit):
+    """Up to limit entries after since, plus whether more are waiting."""
+    entries = ChangeLog.query.filter(ChangeLog.seq > since).order_by(ChangeLog.seq).limit(limit + 1).all()
+    return entries[:limit], len(entries) > limit
+
+def latest_seq():
+    return db.session.query(db.func.max(ChangeLog.seq)).scalar() or 0
+
+COMPACT_BATCH_SIZE = 5000
+
+def compact_changes(older_than):
+    """Drop entries older than the cutoff that a later entry for the same row supersedes.
+
+    The newest entry of every row (including delete tombstones) is kept, so a
+    client resuming from any seq still converges on the current state.
+    Works through the log in seq ranges so each transaction stays short.
+    Returns the number of entries removed.
+    """
+    cutoff = db.session.query(db.func.max(ChangeLog.seq)) \
+        .filter(ChangeLog.created_at < older_than).scalar()
+    if cutoff is None:
+        return 0
+
+    removed = 0
+    start = db.session.query(db.func.min(ChangeLog.seq)).scalar()
+    while start <= cutoff:
+        end = min(start + COMPACT_BATCH_SIZE - 1, cutoff)
+        removed += db.session.execute(text(
+            'DELETE FROM change_log WHERE seq BETWEEN :start AND :end AND EXISTS ('
+            'SELECT 1 FROM change_log newer WHERE newer.table_name = change_log.table_name '
+            'AND newer.row_id = change_log.row_id AND newer.seq > change_log.seq)'
+        ), {'start': start, 'end': end}).rowcount
+        db.session.commit()
+        start = end + 1
+    return removed
+
+def compaction_cutoff(days):
+    return datetime.datetime.utcnow() - datetime.timedelta(days=days)
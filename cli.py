@@ -1,3 +1,6 @@
+import csv
+import io
+import json
 import click
 from flask import current_app as app
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -11,6 +14,49 @@ def get_role_id_by_name(role_name):
         return role.id
     return None
 
+OUTPUT_FORMATS = ['table', 'csv', 'json', 'ndjson']
+STREAM_BATCH_SIZE = 1000
+
+def stream_rows(query, id_column, fmt, limit=None, after=None, table_line=None):
+    """Stream the rows of a column query in id order, writing buffered output in the given format."""
+    if after is not None:
+        query = query.filter(id_column > after)
+    query = query.order_by(id_column)
+    if limit is not None:
+        query = query.limit(limit)
+
+    out = io.StringIO()
+    writer = csv.writer(out)
+    count = 0
+    last_id = None
+    for row in query.yield_per(STREAM_BATCH_SIZE):
+        if fmt == 'table':
+            out.write(table_line(row) + '\n')
+        elif fmt == 'csv':
+            if count == 0:
+                writer.writerow(row._fields)
+            writer.writerow(row)
+        else:
+            encoded = json.dumps(row._asdict())
+            if fmt == 'ndjson':
+                out.write(encoded + '\n')
+            else:
+                out.write(('[' if count == 0 else ',') + encoded)
+        count += 1
+        last_id = row[0]
+        if count % STREAM_BATCH_SIZE == 0:
+            click.echo(out.getvalue(), nl=False)
+            out.seek(0)
+            out.truncate()
+
+    if fmt == 'json':
+        out.write('[]\n' if count == 0 else ']\n')
+    click.echo(out.getvalue(), nl=False)
+
+    # The paging cursor goes to stderr so piped output stays clean
+    if limit is not None and count == limit:
+        click.echo(f'Next page: --after {last_id}', err=True)
+
 @app.cli.command('register')
 @click.argument('username')
 @click.argument('email')
@@ -34,6 +80,33 @@ def register(username, email, password, role_name):
         db.session.commit()
         click.echo(f'User {username} registered successfully')
 
+def read_user_rows(path, fmt):
+    """Yield user dicts from a CSV (with header) or NDJSON file."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+@app.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None, help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Rows per INSERT and per existence check.')
+@click.option('--workers', type=int, default=None, help='Password hashing processes, defaults to the CPU count.')
+def import_users(path, fmt, batch_size, workers):
+    """Bulk-register users from a CSV or NDJSON file with username, email, password and role."""
+    from services import import_users as run_import
+
+    fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with app.app_context():
+        summary = run_import(read_user_rows(path, fmt), batch_size=batch_size, workers=workers)
+
+    click.echo(f"Created: {summary['created']}, Skipped: {summary['skipped']}, Failed: {len(summary['failed'])}")
+    for line_no, reason in summary['failed']:
+        click.echo(f'  line {line_no}: {reason}', err=True)
+
 @app.cli.command('create-cohort')
 @click.argument('name')
 @click.argument('description')
@@ -65,12 +138,28 @@ def create_project(name, description, github_link, owner_email, class_id):
         click.echo(f'Project {name} created successfully')
 
 @app.cli.command('list-projects')
-def list_projects():
+@click.option('--class-id', type=int, help='Only projects in this class.')
+@click.option('--cohort-id', type=int, help='Only projects in classes of this cohort.')
+@click.option('--owner', 'owner_email', help='Only projects owned by this email.')
+@click.option('--name-prefix', help='Only projects whose name starts with this.')
+@click.option('--format', 'fmt', type=click.Choice(OUTPUT_FORMATS), default='table', show_default=True)
+@click.option('--limit', type=click.IntRange(min=1), help='Stop after this many rows.')
+@click.option('--after', type=int, help='Only rows with an ID greater than this (keyset paging).')
+def list_projects(class_id, cohort_id, owner_email, name_prefix, fmt, limit, after):
     """List all projects."""
     with app.app_context():
-        projects = Project.query.all()
-        for project in projects:
-            click.echo(f'ID: {project.id}, Name: {project.name}, Description: {project.description}, GitHub: {project.github_link}')
+        query = db.session.query(Project.id, Project.name, Project.description, Project.github_link,
+                                 Project.class_id, Project.owner_id)
+        if class_id is not None:
+            query = query.filter(Project.class_id == class_id)
+        if cohort_id is not None:
+            query = query.join(Class, Class.id == Project.class_id).filter(Class.cohort_id == cohort_id)
+        if owner_email:
+            query = query.join(User, User.id == Project.owner_id).filter(User.email == owner_email)
+        if name_prefix:
+            query = query.filter(Project.name.startswith(name_prefix, autoescape=True))
+        stream_rows(query, Project.id, fmt, limit, after,
+                    lambda row: f'ID: {row.id}, Name: {row.name}, Description: {row.description}, GitHub: {row.github_link}')
 
 @app.cli.command('create-class')
 @click.argument('name')
@@ -85,12 +174,21 @@ def create_class(name, description, cohort_id):
         click.echo(f'Class {name} created successfully')
 
 @app.cli.command('list-classes')
-def list_classes():
+@click.option('--cohort-id', type=int, help='Only classes in this cohort.')
+@click.option('--name-prefix', help='Only classes whose name starts with this.')
+@click.option('--format', 'fmt', type=click.Choice(OUTPUT_FORMATS), default='table', show_default=True)
+@click.option('--limit', type=click.IntRange(min=1), help='Stop after this many rows.')
+@click.option('--after', type=int, help='Only rows with an ID greater than this (keyset paging).')
+def list_classes(cohort_id, name_prefix, fmt, limit, after):
     """List all classes."""
     with app.app_context():
-        classes = Class.query.all()
-        for cls in classes:
-            click.echo(f'ID: {cls.id}, Name: {cls.name}, Description: {cls.description}')
+        query = db.session.query(Class.id, Class.name, Class.description, Class.cohort_id)
+        if cohort_id is not None:
+            query = query.filter(Class.cohort_id == cohort_id)
+        if name_prefix:
+            query = query.filter(Class.name.startswith(name_prefix, autoescape=True))
+        stream_rows(query, Class.id, fmt, limit, after,
+                    lambda row: f'ID: {row.id}, Name: {row.name}, Description: {row.description}')
 
 @app.cli.command('assign-user-to-class')
 @click.argument('user_email')
@@ -113,26 +211,348 @@ def assign_user_to_class(user_email, class_id):
         click.echo(f'User {user.username} assigned to class {class_.name} successfully')
 
 @app.cli.command('delete-user')
-@click.argument('user_id')
-def delete_user(user_id):
-    """Delete a user."""
+@click.argument('user_ids', nargs=-1, type=int, required=True)
+@click.option('--reassign-to', 'reassign_to', default=None, help='Email of the user that inherits their projects.')
+def delete_user(user_ids, reassign_to):
+    """Delete one or more users, reassigning their projects."""
+    from services import delete_users
+
     with app.app_context():
-        user = User.query.get_or_404(user_id)
-        
-        # Reassign projects to another user (admin) before deleting the user
-        admin_user = User.query.filter_by(email='adminuser@example.com').first()
-        if not admin_user:
-            click.echo('Admin user not found for reassignment')
+        try:
+            deleted = delete_users(user_ids, reassign_to)
+        except ValueError as e:
+            click.echo(str(e))
             return
-        
-        for project in user.projects:
-            project.owner_id = admin_user.id
-        
-        db.session.commit()
 
-        # Delete associated project members
-        ProjectMember.query.filter_by(user_id=user.id).delete()
-        
-        db.session.delete(user)
-        db.session.commit()
-        click.echo('User deleted successfully')
+        missing = sorted(set(user_ids) - set(deleted))
+        if missing:
+            click.echo(f"Users not found: {', '.join(map(str, missing))}")
+        click.echo(f'{len(deleted)} user(s) deleted successfully')
+
+@app.cli.command('stats-verify')
+@click.option('--fix', is_flag=True, help='Rewrite the stored counters from the recomputed values.')
+def stats_verify(fix):
+    """Recompute the statistics counters and compare them with the stored ones."""
+    from stats import compute_counters, stored_counters, write_counters
+
+    with app.app_context():
+        computed = compute_counters()
+        expected = {key: value for key, value in computed.items() if value}
+        stored = stored_counters()
+        drift = sorted(key for key in expected.keys() | stored.keys() if expected.get(key, 0) != stored.get(key, 0))
+
+        for kind, ref_id in drift:
+            click.echo(f'{kind}[{ref_id}]: stored {stored.get((kind, ref_id), 0)}, actual {expected.get((kind, ref_id), 0)}')
+        if not drift:
+            click.echo(f'All {len(expected)} counters match')
+        elif fix:
+            write_counters(computed)
+            db.session.commit()
+            click.echo(f'Rewrote counters, fixed {len(drift)} drifted value(s)')
+        else:
+            click.echo(f'{len(drift)} counter(s) drifted, rerun with --fix to repair')
+
+@app.cli.command('changes-compact')
+@click.option('--older-than-days', type=float, default=7, show_default=True, help='Only compact entries older than this.')
+def changes_compact(older_than_days):
+    """Remove change log entries superseded by a later change to the same row."""
+    from changes import compact_changes, compaction_cutoff
+
+    with app.app_context():
+        removed = compact_changes(compaction_cutoff(older_than_days))
+        click.echo(f'Removed {removed} superseded change log entries')
+
+@app.cli.command('revoked-tokens-purge')
+def revoked_tokens_purge():
+    """Delete revocations of tokens that have already expired."""
+    from revocation import purge_expired
+
+    with app.app_context():
+        click.echo(f'Removed {purge_expired()} expired revocation(s)')
+
+@app.cli.command('idempotency-keys-purge')
+def idempotency_keys_purge():
+    """Delete Idempotency-Key records whose time is up."""
+    from idempotency import purge_expired_keys
+
+    with app.app_context():
+        click.echo(f'Removed {purge_expired_keys()} expired idempotency key(s)')
+
+@app.cli.command('purge-deleted')
+@click.option('--older-than-days', type=float, default=None, help='Only purge rows deleted longer ago than this, '
+              'PURGE_DELETED_AFTER_DAYS by default.')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Rows removed per transaction.')
+def purge_deleted_command(older_than_days, batch_size):
+    """Physically remove deleted users, cohorts, classes, projects and memberships."""
+    from services import purge_deleted, purge_cutoff
+
+    with app.app_context():
+        days = app.config['PURGE_DELETED_AFTER_DAYS'] if older_than_days is None else older_than_days
+        purged = purge_deleted(purge_cutoff(days), batch_size)
+        click.echo('Purged ' + ', '.join(f'{n} {table}' for table, n in purged.items()))
+
+@app.cli.command('undelete')
+@click.argument('kind', type=click.Choice(['user', 'cohort', 'project']))
+@click.argument('row_id', type=int)
+def undelete(kind, row_id):
+    """Restore a deleted user, cohort or project, with the rows deleted along with it, until it is purged."""
+    from models import User, Cohort, Project
+    from services import restore_deleted
+
+    with app.app_context():
+        try:
+            restored = restore_deleted({'user': User, 'cohort': Cohort, 'project': Project}[kind], row_id)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo('Restored ' + ', '.join(f'{n} {table}' for table, n in restored.items()))
+
+@app.cli.group('db-maintain')
+def db_maintain():
+    """Vacuum, analyze, check and inspect the SQLite database."""
+
+@db_maintain.command('vacuum')
+@click.option('--pages', type=int, default=None, help='Free at most this many pages; all free pages by default.')
+@click.option('--full', is_flag=True, help='Rewrite the whole file and turn on incremental vacuum (locks writers out).')
+def db_maintain_vacuum(pages, full):
+    """Return free pages to the filesystem."""
+    from maintenance import vacuum
+
+    with app.app_context():
+        try:
+            before, after = vacuum(pages, full)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f'{before} -> {after} pages, freed {before - after}')
+
+@db_maintain.command('analyze')
+def db_maintain_analyze():
+    """Rebuild the query planner statistics for every table and index."""
+    from maintenance import analyze
+
+    with app.app_context():
+        analyze()
+        click.echo('Statistics rebuilt')
+
+@db_maintain.command('optimize')
+def db_maintain_optimize():
+    """Run PRAGMA optimize, which re-analyzes only tables whose statistics look stale."""
+    from maintenance import optimize
+
+    with app.app_context():
+        optimize()
+        click.echo('Optimized')
+
+@db_maintain.command('check')
+@click.option('--quick', is_flag=True, help='quick_check instead of the full integrity_check.')
+def db_maintain_check(quick):
+    """Check the database file and its foreign keys; exits non-zero on problems."""
+    from maintenance import integrity_check
+
+    with app.app_context():
+        problems = integrity_check(quick)
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise SystemExit(1)
+    click.echo('ok')
+
+@db_maintain.command('checkpoint')
+@click.option('--mode', type=click.Choice(['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'], case_sensitive=False),
+              default='PASSIVE', show_default=True)
+def db_maintain_checkpoint(mode):
+    """Copy the write-ahead log back into the database file."""
+    from maintenance import checkpoint
+
+    with app.app_context():
+        result = checkpoint(mode.upper())
+    if result is None:
+        click.echo('Not in WAL mode, nothing to checkpoint')
+    else:
+        busy, wal_pages, checkpointed = result
+        click.echo(f'{checkpointed}/{wal_pages} WAL pages checkpointed' + (' (busy, rerun later)' if busy else ''))
+
+@db_maintain.command('stats')
+def db_maintain_stats():
+    """File size, free pages and per-table row counts and sizes."""
+    from maintenance import file_stats, table_stats
+
+    with app.app_context():
+        info = file_stats()
+        tables = table_stats()
+    click.echo(f"{info['pages'] * info['page_size'] / 1024:.0f} KiB in {info['pages']} pages, "
+               f"{info['free_pages']} free, journal {info['journal_mode']}, auto_vacuum {info['auto_vacuum']}")
+    click.echo(f"{'table':24} {'rows':>10} {'KiB':>10}")
+    for table, rows, size in tables:
+        click.echo(f"{table:24} {rows:10} {'-' if size is None else f'{size / 1024:.0f}':>10}")
+
+@db_maintain.command('all')
+def db_maintain_all():
+    """What the background scheduler runs: a bounded purge of deleted rows, expired idempotency
+    keys, optimize, a bounded incremental vacuum and a passive checkpoint."""
+    from maintenance import idle_maintenance
+
+    with app.app_context():
+        idle_maintenance()
+        click.echo('Done')
+
+@app.cli.group('backup')
+def backup():
+    """Online backups of the database and restores from them."""
+
+@backup.command('create')
+@click.option('--no-compress', is_flag=True, help='Keep the copy as a plain .db file instead of gzipping it.')
+@click.option('--keep', type=int, default=None, help='Backups to keep after rotation, BACKUP_KEEP by default; 0 keeps all.')
+def backup_create(no_compress, keep):
+    """Copy the live database a few pages at a time, verify the copy and rotate old backups."""
+    from backups import create_backup
+
+    with app.app_context():
+        try:
+            summary = create_backup(not no_compress, keep)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+    click.echo(f"Wrote {summary['path']} ({summary['bytes'] / 1024:.0f} KiB)")
+    for name in summary['deleted']:
+        click.echo(f'Rotated out {name}')
+
+@backup.command('list')
+def backup_list():
+    """List backups, newest first."""
+    from backups import list_backups
+
+    with app.app_context():
+        for name, size, created in list_backups():
+            click.echo(f'{name:45} {size / 1024:10.0f} KiB  {created:%Y-%m-%d %H:%M:%S} UTC')
+
+@backup.command('restore')
+@click.argument('backup_file')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def backup_restore(backup_file, yes):
+    """Replace the database with BACKUP_FILE (a path or a name from `flask backup list`).
+
+    The backup is integrity-checked first and the current database is backed
+    up before being overwritten. Restart the app afterwards so workers drop
+    their caches.
+    """
+    from backups import restore_backup
+
+    if not yes:
+        click.confirm(f'Replace the current database with {backup_file}?', abort=True)
+    with app.app_context():
+        try:
+            summary = restore_backup(backup_file)
+        except (RuntimeError, OSError) as e:
+            raise click.ClickException(str(e))
+    click.echo(f"Restored {summary['restored']}; the previous contents are in {summary['previous']}")
+
+@app.cli.group('archive')
+def archive():
+    """Move finished cohorts into the cold archive file and back."""
+
+@archive.command('cohort')
+@click.argument('cohort_ids', nargs=-1, type=int, required=True)
+def archive_cohorts(cohort_ids):
+    """Move cohorts with their classes, projects and members into the archive, one cohort at a time."""
+    from archive import archive_cohort
+
+    with app.app_context():
+        for cohort_id in cohort_ids:
+            try:
+                moved = archive_cohort(cohort_id)
+            except ValueError as e:
+                click.echo(f'Error: {e}', err=True)
+                continue
+            click.echo(f'Archived cohort {cohort_id}: ' + ', '.join(f'{n} {table}' for table, n in moved.items()))
+
+@archive.command('restore')
+@click.argument('cohort_ids', nargs=-1, type=int, required=True)
+def archive_restore(cohort_ids):
+    """Move archived cohorts back into the main database."""
+    from archive import unarchive_cohort
+
+    with app.app_context():
+        for cohort_id in cohort_ids:
+            try:
+                moved = unarchive_cohort(cohort_id)
+            except ValueError as e:
+                click.echo(f'Error: {e}', err=True)
+                continue
+            click.echo(f'Restored cohort {cohort_id}: ' + ', '.join(f'{n} {table}' for table, n in moved.items()))
+
+@archive.command('list')
+def archive_list():
+    """List archived cohorts."""
+    from models import ArchivedCohort
+
+    with app.app_context():
+        for cohort in ArchivedCohort.query.order_by(ArchivedCohort.id):
+            click.echo(f'{cohort.id:6} {cohort.name}')
+
+@app.cli.command('check-query-budgets')
+@click.option('--sizes', default='10,50,200', show_default=True, help='Comma separated row counts per table to check at.')
+@click.option('--verbose', is_flag=True, help='Print every route with its statement counts.')
+def check_query_budgets(sizes, verbose):
+    """Check every API route against its @query_budget on scratch databases of several sizes."""
+    from budgets import check_budgets
+
+    report, failures = check_budgets(app._get_current_object(), [int(size) for size in sizes.split(',')])
+    if verbose:
+        for line in report:
+            click.echo(line)
+    for failure in failures:
+        click.echo(f'FAIL {failure}', err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo(f'All {len(report)} routes within their query budgets')
+
+@app.cli.command('loadtest')
+@click.option('--url', default='http://localhost:8000', show_default=True, help='Base URL of the running server.')
+@click.option('--mix', default='read', show_default=True, help='read, mixed, write, or operation=weight pairs, e.g. get_project=80,login=20.')
+@click.option('--rate', type=float, default=20, show_default=True, help='Requests per second to offer, whatever the response times.')
+@click.option('--duration', type=float, default=30, show_default=True, help='Seconds to keep issuing requests.')
+@click.option('--concurrency', type=int, default=32, show_default=True, help='Most requests in flight at once.')
+@click.option('--zipf', 'zipf_s', type=float, default=1.0, show_default=True, help='Skew of project/class key selection, 0 is uniform.')
+@click.option('--email', default=None, help='Account for logins and authenticated routes.')
+@click.option('--password', default=None)
+@click.option('--seed', type=int, default=None, help='Seed for reproducible key and operation choices.')
+@click.option('--timeout', type=float, default=10, show_default=True, help='Seconds before a request counts as an error.')
+def loadtest(url, mix, rate, duration, concurrency, zipf_s, email, password, seed, timeout):
+    """Drive a running server with a workload mix and report per-operation throughput and latency.
+
+    Write operations create real projects (named "Load test ...") and only ever
+    update the ones they created.
+    """
+    from loadtest import AUTHENTICATED, LoadRun, Target, parse_mix, report, run_load
+
+    try:
+        weights = parse_mix(mix)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--mix')
+    needs_auth = bool(AUTHENTICATED & weights.keys())
+    if needs_auth and not (email and password):
+        raise click.UsageError(f'--email and --password are needed for {", ".join(sorted(AUTHENTICATED & weights.keys()))}')
+
+    run = LoadRun(Target(url, timeout), zipf_s=zipf_s, email=email, password=password, seed=seed)
+    try:
+        run.prepare(needs_auth)
+    except (RuntimeError, OSError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Offering {rate:g} req/s for {duration:g}s to {url} with up to {concurrency} in flight')
+    elapsed = run_load(run, weights, rate, duration, concurrency)
+    for line in report(run, elapsed):
+        click.echo(line)
+
+@app.cli.command('serve')
+@click.option('--bind', default=None, help='Address to listen on, defaults to 0.0.0.0:$PORT.')
+@click.option('--workload', type=click.Choice(['cpu', 'io', 'mixed']), default=None, help='Workload hint used to pick workers and threads.')
+@click.option('--workers', type=int, default=None, help='Override the autotuned worker count.')
+@click.option('--threads', type=int, default=None, help='Override the autotuned threads per worker.')
+def serve(bind, workload, workers, threads):
+    """Serve the app with preloaded, copy-on-write friendly gunicorn workers."""
+    from serve import ServeApplication, gunicorn_options
+
+    options = gunicorn_options(workload=workload, bind=bind, workers=workers, threads=threads)
+    if options['threads'] > 1:
+        options['worker_class'] = 'gthread'
+    click.echo(f"Starting {options['workers']} {options['worker_class']} workers x {options['threads']} threads on {options['bind']}")
+    ServeApplication(app._get_current_object(), options).run()
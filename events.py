@@ -0,0 +1,155 @@
+import json
+import os
+import queue
+import threading
+import time
+from app import db
+from models import Project, Class
+from changes import changes_since, latest_seq
+
+# change_log tables pushed to subscribers, and the event type prefix each gets
+EVENT_TABLES = {'cohort': 'cohort', 'class': 'class', 'project': 'project', 'project_member': 'membership'}
+POLL_INTERVAL = 0.5
+POLL_BATCH_SIZE = 1000
+SUBSCRIBER_QUEUE_SIZE = 1000
+MAX_CACHED_PARENTS = 100000
+
+class Subscription:
+    """One connected client: a bounded queue plus its cohort/class filter."""
+
+    def __init__(self, cohort_id=None, class_id=None):
+        self.cohort_id = cohort_id
+        self.class_id = class_id
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def matches(self, event):
+        if self.cohort_id is not None and event['cohort_id'] != self.cohort_id:
+            return False
+        if self.class_id is not None and event['class_id'] != self.class_id:
+            return False
+        return True
+
+    def offer(self, event):
+        if self.closed or not self.matches(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Too slow to keep up; it reconnects with Last-Event-ID and replays from the log
+            self.closed = True
+
+class ChangeNotifier:
+    """Polls change_log once per interval for the whole worker and fans new entries out."""
+
+    def __init__(self, app):
+        self.app = app
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_seq = 0
+        # child id -> parent id, learned from events so deleted rows can still be placed
+        self.project_class = {}
+        self.class_cohort = {}
+
+    def subscribe(self, subscription, limit=None):
+        """Add subscription; the last seq it has seen, or None when limit subscribers are already in."""
+        with self.lock:
+            if limit is not None and len(self.subscribers) >= limit:
+                return None
+            if self.thread is None:
+                self.last_seq = latest_seq()
+                self.thread = threading.Thread(target=self.run, name='change-notifier', daemon=True)
+                self.thread.start()
+            self.subscribers.add(subscription)
+            return self.last_seq
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def run(self):
+        with self.app.app_context():
+            while True:
+                with self.lock:
+                    if not self.subscribers:
+                        self.thread = None
+                        return
+                    subscribers = list(self.subscribers)
+                try:
+                    has_more = True
+                    while has_more:
+                        entries, has_more = changes_since(self.last_seq, POLL_BATCH_SIZE)
+                        if entries:
+                            self.last_seq = entries[-1].seq
+                        for event in self.to_events(entries):
+                            for subscription in subscribers:
+                                subscription.offer(event)
+                finally:
+                    # End the read so the next poll sees newly committed writes
+                    db.session.rollback()
+                time.sleep(POLL_INTERVAL)
+
+    def to_events(self, entries):
+        """Turn change_log entries into events tagged with the cohort and class they belong to."""
+        entries = [entry for entry in entries if entry.table_name in EVENT_TABLES]
+        rows = [(entry, json.loads(entry.data) if entry.data else {}) for entry in entries]
+
+        for entry, data in rows:
+            if entry.table_name == 'class' and data.get('cohort_id') is not None:
+                self.class_cohort[entry.row_id] = data['cohort_id']
+            elif entry.table_name == 'project' and data.get('class_id') is not None:
+                self.project_class[entry.row_id] = data['class_id']
+        self.resolve_parents(
+            {data.get('project_id') for entry, data in rows if entry.table_name == 'project_member'},
+            {data.get('class_id') for entry, data in rows if entry.table_name == 'project'})
+
+        events = []
+        for entry, data in rows:
+            if entry.table_name == 'cohort':
+                class_id, cohort_id = None, entry.row_id
+            elif entry.table_name == 'class':
+                class_id, cohort_id = entry.row_id, data.get('cohort_id')
+            else:
+                project_id = entry.row_id if entry.table_name == 'project' else data.get('project_id')
+                class_id = self.project_class.get(project_id)
+                cohort_id = self.class_cohort.get(class_id)
+            events.append({
+                'seq': entry.seq,
+                'event': f'{EVENT_TABLES[entry.table_name]}.{entry.op}',
+                'id': entry.row_id,
+                'data': data or None,
+                'class_id': class_id,
+                'cohort_id': cohort_id
+            })
+        return events
+
+    def resolve_parents(self, project_ids, class_ids):
+        if len(self.project_class) > MAX_CACHED_PARENTS or len(self.class_cohort) > MAX_CACHED_PARENTS:
+            self.project_class.clear()
+            self.class_cohort.clear()
+
+        missing = [project_id for project_id in project_ids if project_id is not None and project_id not in self.project_class]
+        if missing:
+            self.project_class.update(db.session.query(Project.id, Project.class_id).filter(Project.id.in_(missing)))
+        class_ids = class_ids | {self.project_class.get(project_id) for project_id in project_ids}
+        missing = [class_id for class_id in class_ids if class_id is not None and class_id not in self.class_cohort]
+        if missing:
+            self.class_cohort.update(db.session.query(Class.id, Class.cohort_id).filter(Class.id.in_(missing)))
+
+_notifier = None
+_notifier_pid = None
+_notifier_lock = threading.Lock()
+
+def get_notifier(app):
+    """The notifier for this worker process."""
+    global _notifier, _notifier_pid
+    with _notifier_lock:
+        if _notifier is None or _notifier_pid != os.getpid():
+            _notifier = ChangeNotifier(app)
+            _notifier_pid = os.getpid()
+    return _notifier
+
+def format_event(event):
+    payload = json.dumps({key: value for key, value in event.items() if key != 'event'})
+    return f"id: {event['seq']}\nevent: {event['event']}\ndata: {payload}\n\n"
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+from app import db
+from models import ChangeLog
+from media import media_urls
+from services import chunks
+
+MAX_FRAGMENTS = 100000
+# Past this many unseen changes it is cheaper to start over than to evict one by one
+MAX_EVICTIONS = 10000
+# What an empty list renders to, with and without media_refs
+EMPTY_LISTS = (b'[]', b'{"items":[],"media":{}}')
+
+def encode(row):
+    # Same key order and separators as jsonify, so fragments splice into identical output
+    return json.dumps(row, separators=(',', ':'), sort_keys=True).encode()
+
+class FragmentCache:
+    """Per-worker cache of each row's encoded to_dict() JSON, keyed by (table, id, media_refs).
+
+    A fragment's version is the change_log seq it was encoded at. Before every
+    list render the cache reads change_log entries past the last seq it has
+    seen and drops the fragments of those rows, so a one-row change costs one
+    re-encode instead of N. Fresh fragments are only stored while the cache is
+    still at the seq they were read at.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fragments = {}
+        self.last_seq = None
+
+    def sync(self):
+        with self.lock:
+            query = db.session.query(ChangeLog.seq, ChangeLog.table_name, ChangeLog.row_id)
+            if self.last_seq is not None:
+                changes = query.filter(ChangeLog.seq > self.last_seq) \
+                    .order_by(ChangeLog.seq).limit(MAX_EVICTIONS + 1).all()
+                if len(changes) <= MAX_EVICTIONS:
+                    for seq, table, row_id in changes:
+                        self.fragments.pop((table, row_id, False), None)
+                        self.fragments.pop((table, row_id, True), None)
+                        self.last_seq = seq
+                    return
+            self.fragments.clear()
+            self.last_seq = db.session.query(db.func.max(ChangeLog.seq)).scalar() or 0
+
+    def render(self, model, query, media_refs=False):
+        """The JSON array of to_dict() for every row of query, spliced from cached fragments,
+        and the poster ids those rows reference."""
+        self.sync()
+        table = model.__tablename__
+        version = self.last_seq
+        ids = [row_id for (row_id,) in query.order_by(model.id).with_entities(model.id)]
+
+        found = {row_id: self.fragments.get((table, row_id, media_refs)) for row_id in ids}
+        missing = [row_id for row_id, fragment in found.items() if fragment is None]
+        rendered = {}
+        for batch in chunks(missing):
+            for obj in model.query.filter(model.id.in_(batch)):
+                rendered[obj.id] = (version, encode(obj.to_dict(media_refs)), getattr(obj, 'poster_id', None))
+        found.update(rendered)
+
+        with self.lock:
+            # Another thread's sync() may have evicted some of these rows since they were
+            # read; storing them then would bring the old bytes back for good
+            if self.last_seq == version:
+                for row_id, fragment in rendered.items():
+                    self.fragments[(table, row_id, media_refs)] = fragment
+            if len(self.fragments) > MAX_FRAGMENTS:
+                self.fragments.clear()
+        fragments = [found[row_id] for row_id in ids if found[row_id] is not None]
+        body = b'[' + b','.join(fragment[1] for fragment in fragments) + b']'
+        return body, {fragment[2] for fragment in fragments}
+
+_cache = None
+_cache_pid = None
+
+def get_fragment_cache():
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = FragmentCache()
+        _cache_pid = os.getpid()
+    return _cache
+
+def render_list(model, query, media_refs=False, archived=None):
+    """The rows of query as a JSON array; with media_refs rows carry poster_id instead and the
+    URLs they use are sent once, as {"items": [...], "media": {id: url}}.
+
+    Rows of the optional archived query are appended after the live ones. They
+    are rarely read, so they are encoded on the spot rather than cached.
+    """
+    body, poster_ids = get_fragment_cache().render(model, query, media_refs)
+    if archived is not None:
+        rows = archived.order_by(archived.column_descriptions[0]['entity'].id).all()
+        if rows:
+            fragments = b','.join(encode(row.to_dict(media_refs)) for row in rows)
+            body = body[:-1] + (b',' if body != b'[]' else b'') + fragments + b']'
+            poster_ids |= {row.poster_id for row in rows}
+    if not media_refs:
+        return body
+    return b'{"items":' + body + b',"media":' + encode(media_urls(poster_ids)) + b'}'
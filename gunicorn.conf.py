@@ -0,0 +1,5 @@
+# Gunicorn picks this file up automatically: `gunicorn app:app`
+from serve import gunicorn_options
+
+wsgi_app = 'app:app'
+globals().update(gunicorn_options())
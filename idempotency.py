@@ -0,0 +1,117 @@
+import datetime
+import hashlib
+import json
+from functools import wraps
+from flask import Response, current_app, jsonify, make_response, request
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+def fingerprint():
+    """sha256 of the method, path and body, with the JSON body canonicalized so key order doesn't matter."""
+    body = request.get_json(silent=True)
+    payload = json.dumps(body, sort_keys=True, separators=(',', ':')) if body is not None \
+        else request.get_data(as_text=True)
+    return hashlib.sha256(f'{request.method} {request.full_path}\n{payload}'.encode()).digest()
+
+def claim(owner_id, key, digest):
+    """Claim key for this request; the claim's lease deadline if it's ours to run, else None.
+
+    A claim whose time is up is taken over as if it never existed: a stored
+    response once IDEMPOTENCY_KEY_TTL_HOURS have passed, a request still in
+    flight (or whose worker died) once its IDEMPOTENCY_LEASE_SECONDS lease
+    has. Key rows are written on their own connection and committed at once,
+    so the route's session (and the objects it has loaded) is left alone.
+    """
+    now = datetime.datetime.utcnow()
+    lease_until = now + datetime.timedelta(seconds=current_app.config['IDEMPOTENCY_LEASE_SECONDS'])
+    statement = sqlite_insert(IdempotencyKey).values(
+        owner_id=owner_id, key=key, fingerprint=digest, expires_at=lease_until)
+    statement = statement.on_conflict_do_update(
+        index_elements=['owner_id', 'key'],
+        set_={'fingerprint': statement.excluded.fingerprint, 'status': None, 'body': None,
+              'expires_at': statement.excluded.expires_at},
+        where=IdempotencyKey.expires_at <= now,
+    ).returning(IdempotencyKey.key)
+    with db.engine.begin() as conn:
+        return lease_until if conn.execute(statement).first() is not None else None
+
+def settle(owner_id, key, lease_until, response=None):
+    """Store the response for key, or drop the claim so a retry runs the request again.
+
+    Only the claim made with lease_until is touched, not one a retry took over after the lease ran out.
+    """
+    where = (IdempotencyKey.owner_id == owner_id) & (IdempotencyKey.key == key) \
+        & IdempotencyKey.status.is_(None) & (IdempotencyKey.expires_at == lease_until)
+    with db.engine.begin() as conn:
+        if response is None:
+            conn.execute(delete(IdempotencyKey).where(where))
+        else:
+            expires_at = datetime.datetime.utcnow() + \
+                datetime.timedelta(hours=current_app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+            conn.execute(update(IdempotencyKey).where(where)
+                         .values(status=response.status_code, body=response.get_data(), expires_at=expires_at))
+
+def replay(record, digest):
+    """The response for a retry of an already claimed key; record is None if the claim has just gone."""
+    if record is not None and record.fingerprint != digest:
+        return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+    if record is None or record.status is None:
+        response = jsonify({'error': f'A request with this {HEADER} is still in progress'})
+        response.headers['Retry-After'] = '1'
+        return response, 409
+    response = Response(record.body, status=record.status, mimetype='application/json')
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+def idempotent(f):
+    """Honor the Idempotency-Key header on a POST route, below @token_required.
+
+    The first request with a key runs and its response (unless a 5xx, which
+    frees the key for a retry) is stored; retries with the same key and
+    request get that response back without running the route again. Keys
+    are per user and remembered for IDEMPOTENCY_KEY_TTL_HOURS; a request
+    that never finishes holds its key for IDEMPOTENCY_LEASE_SECONDS. Requests
+    without the header are unaffected.
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return f(current_user, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}), 400
+
+        digest = fingerprint()
+        owner_id = current_user.id
+        lease_until = claim(owner_id, key, digest)
+        if lease_until is None:
+            record = db.session.get(IdempotencyKey, (owner_id, key))
+            # The request holding the key may have failed and let go of it since our claim was refused
+            lease_until = claim(owner_id, key, digest) if record is None else None
+            if lease_until is None:
+                return replay(record, digest)
+
+        try:
+            response = make_response(f(current_user, *args, **kwargs))
+        except Exception:
+            # Let go of anything the route left half-written before touching the key's row
+            db.session.rollback()
+            settle(owner_id, key, lease_until)
+            raise
+        settle(owner_id, key, lease_until, response if response.status_code < 500 else None)
+        return response
+
+    return decorated
+
+def purge_expired_keys():
+    """Delete idempotency keys whose time is up."""
+    removed = db.session.query(IdempotencyKey) \
+        .filter(IdempotencyKey.expires_at <= datetime.datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
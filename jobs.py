@@ -0,0 +1,206 @@
+import datetime
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import select, update
+from app import db
+from models import Job
+
+# Job kinds by name, filled in with the @job_type decorator
+JOB_TYPES = {}
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+def job_type(name):
+    def decorator(func):
+        JOB_TYPES[name] = func
+        return func
+    return decorator
+
+class JobCancelled(Exception):
+    pass
+
+class JobContext:
+    """Handed to a running job so it can report progress and notice cancellation."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def progress(self, done, total=None, message=None):
+        values = {'done': done, 'updated_at': datetime.datetime.utcnow()}
+        if total is not None:
+            values['total'] = total
+        if message is not None:
+            values['message'] = message[:200]
+        # Own connection, so the job's pending work in db.session is not committed with it
+        with db.engines['jobs'].begin() as conn:
+            conn.execute(update(Job).where(Job.id == self.job_id).values(**values))
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        with db.engines['jobs'].connect() as conn:
+            if conn.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar():
+                raise JobCancelled()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def get_executor(app):
+    """The per-process job pool, created lazily so it is never inherited across fork()."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=app.config['JOBS_MAX_WORKERS'], thread_name_prefix='job')
+            _executor_pid = os.getpid()
+            recover_jobs(app, _executor)
+    return _executor
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def recover_jobs(app, executor):
+    """Requeue jobs left queued or running by a worker process that no longer exists."""
+    with app.app_context():
+        stale = db.session.query(Job.id, Job.pid).filter(Job.status.in_(('queued', 'running'))).all()
+        for job_id, pid in stale:
+            if pid == os.getpid() or pid_alive(pid):
+                continue
+            # Only one restarted worker wins the claim
+            claimed = db.session.execute(
+                update(Job).where(Job.id == job_id, Job.pid == pid)
+                .values(pid=os.getpid(), status='queued', updated_at=datetime.datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                executor.submit(run_job, app, job_id)
+
+def submit_job(kind, params=None, owner_id=None):
+    """Persist a new job and queue it on this process's pool."""
+    if kind not in JOB_TYPES:
+        raise ValueError(f'Unknown job type {kind}')
+    now = datetime.datetime.utcnow()
+    job = Job(id=uuid.uuid4().hex, kind=kind, params=json.dumps(params or {}), status='queued',
+              owner_id=owner_id, pid=os.getpid(), created_at=now, updated_at=now)
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    get_executor(app).submit(run_job, app, job.id)
+    return job
+
+def cancel_job(job):
+    """Ask a job to stop; queued jobs never start, running ones stop at their next progress report."""
+    if job.status in FINISHED:
+        return False
+    job.cancel_requested = True
+    job.updated_at = datetime.datetime.utcnow()
+    db.session.commit()
+    return True
+
+def run_job(app, job_id):
+    with app.app_context():
+        job = db.session.get(Job, job_id)
+        if job is None or job.status in FINISHED:
+            return
+        if job.cancel_requested:
+            finish(job, 'cancelled')
+            return
+
+        job.status = 'running'
+        job.updated_at = datetime.datetime.utcnow()
+        db.session.commit()
+
+        try:
+            result = JOB_TYPES[job.kind](JobContext(job_id), **json.loads(job.params))
+            db.session.commit()
+            job = db.session.get(Job, job_id)
+            if result is not None:
+                job.result, job.result_type = result
+            finish(job, 'succeeded')
+        except JobCancelled:
+            db.session.rollback()
+            finish(db.session.get(Job, job_id), 'cancelled')
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.error = str(e)
+            finish(job, 'failed')
+        finally:
+            db.session.remove()
+
+def finish(job, status):
+    job.status = status
+    # Parameters can hold request payloads (e.g. passwords), so they are not kept around
+    job.params = '{}'
+    job.updated_at = datetime.datetime.utcnow()
+    db.session.commit()
+
+# Job Types
+
+@job_type('delete_cohort')
+def delete_cohort_job(ctx, cohort_id):
+    """Tombstone a cohort one class per transaction, so writers are never locked out for long."""
+    from models import Cohort, Class
+    from services import tombstone, tombstone_classes, utcnow
+
+    stamp = utcnow()
+    class_ids = [class_id for (class_id,) in db.session.query(Class.id).filter_by(cohort_id=cohort_id)]
+    ctx.progress(0, len(class_ids) + 1)
+    for done, class_id in enumerate(class_ids, start=1):
+        tombstone_classes([class_id], stamp)
+        db.session.commit()
+        ctx.progress(done)
+
+    tombstone(db.session.query(Cohort).filter_by(id=cohort_id), Cohort, stamp)
+    db.session.commit()
+    ctx.progress(len(class_ids) + 1)
+    return json.dumps({'cohort_id': cohort_id, 'classes_deleted': len(class_ids)}), 'application/json'
+
+EXPORT_TABLES = ('cohorts', 'classes', 'projects', 'project_members')
+EXPORT_BATCH_SIZE = 1000
+
+@job_type('export')
+def export_job(ctx, tables=EXPORT_TABLES):
+    """Dump tables as NDJSON lines of {"table": ..., "row": {...}}."""
+    from models import Cohort, Class, Project, ProjectMember
+
+    models = {'cohorts': Cohort, 'classes': Class, 'projects': Project, 'project_members': ProjectMember}
+    lines, done = [], 0
+    for table in tables:
+        for row in models[table].query.order_by(models[table].id).yield_per(EXPORT_BATCH_SIZE):
+            lines.append(json.dumps({'table': table, 'row': row.to_dict()}))
+            done += 1
+            if done % EXPORT_BATCH_SIZE == 0:
+                ctx.progress(done, message=f'exporting {table}')
+    ctx.progress(done)
+    return '\n'.join(lines) + '\n', 'application/x-ndjson'
+
+# Processes an import job hashes passwords in; the worker's request threads keep the other cores
+IMPORT_HASH_WORKERS = 2
+
+@job_type('import_users')
+def import_users_job(ctx, users):
+    from services import import_users
+
+    summary = import_users(users, workers=IMPORT_HASH_WORKERS, progress=lambda done, total: ctx.progress(done, total))
+    return json.dumps(summary), 'application/json'
+
+@job_type('backup')
+def backup_job(ctx, compress=True):
+    from backups import create_backup
+
+    summary = create_backup(compress, progress=lambda done, total: ctx.progress(done, total, 'copying pages'))
+    summary['path'] = os.path.basename(summary['path'])
+    return json.dumps(summary), 'application/json'
@@ -0,0 +1,258 @@
+import bisect
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import jwt
+
+# Operations by name, filled in with the @operation decorator
+OPERATIONS = {}
+
+# Operations that need --email/--password
+AUTHENTICATED = {'get_users', 'login', 'create_project', 'update_project'}
+
+# Preset workload mixes, as operation -> relative weight
+MIXES = {
+    'read': {'get_project': 50, 'list_projects': 10, 'class_projects': 20, 'list_cohorts': 20},
+    'mixed': {'get_project': 35, 'list_projects': 5, 'class_projects': 15, 'list_cohorts': 10,
+              'get_users': 10, 'login': 5, 'create_project': 5, 'update_project': 15},
+    'write': {'create_project': 40, 'update_project': 50, 'login': 10},
+}
+
+def operation(name):
+    def decorator(func):
+        OPERATIONS[name] = func
+        return func
+    return decorator
+
+def parse_mix(spec):
+    """A preset name from MIXES or "op=weight,op=weight"."""
+    if spec in MIXES:
+        return dict(MIXES[spec])
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Unknown operation {name!r}, expected one of {", ".join(sorted(OPERATIONS))}')
+        mix[name] = float(weight or 1)
+    return mix
+
+class Zipf:
+    """Draws ranks 0..n-1 with P(rank) proportional to 1 / (rank + 1) ** s."""
+
+    def __init__(self, n, s=1.0):
+        weights = [1 / (rank + 1) ** s for rank in range(n)]
+        total = sum(weights)
+        self.cdf = list(itertools.accumulate(weight / total for weight in weights))
+
+    def rank(self, rng):
+        return min(bisect.bisect_left(self.cdf, rng.random()), len(self.cdf) - 1)
+
+class Target:
+    """The server under test, with one keep-alive connection per thread."""
+
+    def __init__(self, base_url, timeout=10):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        """(status, parsed JSON or None); a broken connection is dropped and the error raised."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.connection_class(self.netloc, timeout=self.timeout)
+        headers = {}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        try:
+            conn.request(method, self.prefix + path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+        except Exception:
+            conn.close()
+            self.local.conn = None
+            raise
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+class LoadRun:
+    """Keys, credentials and results shared by every request of one load test."""
+
+    def __init__(self, target, zipf_s=1.0, email=None, password=None, seed=None):
+        self.target = target
+        self.email = email
+        self.password = password
+        self.token = None
+        self.user_id = None
+        self.seed = seed
+        self.zipf_s = zipf_s
+        self.lock = threading.Lock()
+        self.created = []
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.local = threading.local()
+
+    def prepare(self, needs_auth):
+        """Log in if the mix needs it and discover the project and class ids to draw keys from."""
+        if needs_auth:
+            status, body = self.target.request('POST', '/api/login', {'email': self.email, 'password': self.password})
+            if status != 200:
+                raise RuntimeError(f'Login as {self.email} failed with HTTP {status}')
+            self.token = body['token']
+            self.user_id = jwt.decode(self.token, options={'verify_signature': False})['user_id']
+
+        status, projects = self.target.request('GET', '/api/projects?media=refs')
+        self.project_ids = [row['id'] for row in projects['items']] if status == 200 else []
+        status, classes = self.target.request('GET', '/api/classes?media=refs')
+        self.class_ids = [row['id'] for row in classes['items']] if status == 200 else []
+        if not self.project_ids or not self.class_ids:
+            raise RuntimeError('The server has no projects or classes to draw keys from')
+
+        # Shuffle so the hot keys are spread over the id range rather than the oldest rows
+        shuffler = random.Random(self.seed)
+        shuffler.shuffle(self.project_ids)
+        shuffler.shuffle(self.class_ids)
+        self.project_keys = Zipf(len(self.project_ids), self.zipf_s)
+        self.class_keys = Zipf(len(self.class_ids), self.zipf_s)
+
+    @property
+    def rng(self):
+        rng = getattr(self.local, 'rng', None)
+        if rng is None:
+            rng = self.local.rng = random.Random(None if self.seed is None else f'{self.seed}-{threading.get_ident()}')
+        return rng
+
+    def project_id(self):
+        return self.project_ids[self.project_keys.rank(self.rng)]
+
+    def class_id(self):
+        return self.class_ids[self.class_keys.rank(self.rng)]
+
+    def record(self, name, status, latency):
+        with self.lock:
+            self.latencies[name].append(latency)
+            self.statuses[name][status] += 1
+
+# Operations
+
+@operation('get_project')
+def get_project(run):
+    return run.target.request('GET', f'/api/projects/{run.project_id()}')[0]
+
+@operation('list_projects')
+def list_projects(run):
+    return run.target.request('GET', '/api/projects')[0]
+
+@operation('class_projects')
+def class_projects(run):
+    return run.target.request('GET', f'/api/classes/{run.class_id()}/projects')[0]
+
+@operation('list_cohorts')
+def list_cohorts(run):
+    return run.target.request('GET', '/api/cohorts')[0]
+
+@operation('get_users')
+def get_users(run):
+    return run.target.request('GET', '/api/users', token=run.token)[0]
+
+@operation('login')
+def login(run):
+    return run.target.request('POST', '/api/login', {'email': run.email, 'password': run.password})[0]
+
+@operation('create_project')
+def create_project(run):
+    status, body = run.target.request('POST', '/api/projects', {
+        'name': f'Load test {uuid.uuid4().hex[:8]}',
+        'description': 'Created by flask loadtest, safe to delete',
+        'github_link': 'https://github.com/loadtest/project',
+        'owner_id': run.user_id,
+        'class_id': run.class_id(),
+    }, token=run.token)
+    if status == 201 and body:
+        with run.lock:
+            run.created.append(body['id'])
+    return status
+
+@operation('update_project')
+def update_project(run):
+    # Only projects this run created are touched; the newest ones are the hot keys
+    with run.lock:
+        if not run.created:
+            project_id = None
+        else:
+            project_id = run.created[-1 - run.project_keys.rank(run.rng) % len(run.created)]
+    if project_id is None:
+        return create_project(run)
+    return run.target.request('PUT', f'/api/projects/{project_id}', {
+        'description': f'Updated by flask loadtest at {time.time():.3f}'
+    }, token=run.token)[0]
+
+def execute(run, name, scheduled):
+    try:
+        status = OPERATIONS[name](run)
+    except Exception:
+        status = None
+    # Measured from when the request was due, not when a thread got to it, so a
+    # backed-up client still shows the queueing delay a real user would see
+    run.record(name, status, time.perf_counter() - scheduled)
+
+def run_load(run, mix, rate, duration, concurrency):
+    """Open-loop load: arrivals are a Poisson process at rate per second, whatever the response times.
+
+    Returns the wall-clock seconds until the last response came back.
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    rng = random.Random(run.seed)
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='load')
+
+    start = time.perf_counter()
+    due = start
+    while due < start + duration:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pool.submit(execute, run, rng.choices(names, weights)[0], due)
+        due += rng.expovariate(rate)
+    pool.shutdown(wait=True)
+    return time.perf_counter() - start
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def report(run, elapsed):
+    """One line per operation plus a total: count, throughput, latency percentiles in ms, error and shed rates."""
+    lines = [f'{"operation":16} {"count":>7} {"req/s":>8} {"p50":>8} {"p90":>8} {"p99":>8} {"max":>8} {"errors":>7} {"429/503":>8}']
+    rows = sorted(run.latencies.items()) + [('total', [l for values in run.latencies.values() for l in values])]
+    for name, latencies in rows:
+        statuses = defaultdict(int)
+        for op_name, counts in run.statuses.items():
+            if name in ('total', op_name):
+                for status, count in counts.items():
+                    statuses[status] += count
+        count = len(latencies)
+        if not count:
+            continue
+        shed = statuses[429] + statuses[503]
+        errors = sum(n for status, n in statuses.items() if status is None or (status >= 400 and status not in (429, 503)))
+        values = sorted(latencies)
+        lines.append(f'{name:16} {count:7} {count / elapsed:8.1f} '
+                     + ' '.join(f'{percentile(values, q) * 1000:8.1f}' for q in (0.5, 0.9, 0.99, 1.0))
+                     + f' {errors / count:7.1%} {shed / count:8.1%}')
+    return lines
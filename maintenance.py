@@ -0,0 +1,187 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from flask import current_app
+from sqlalchemy import text
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# Pages an idle-time incremental vacuum frees at most, so it never holds the write lock for long
+IDLE_VACUUM_PAGES = 2000
+# Purge batches an idle run does at most; the rest waits for the next run
+IDLE_PURGE_BATCHES = 20
+
+def autocommit():
+    # VACUUM and some pragmas refuse to run inside a transaction
+    return db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+def pragma(conn, statement):
+    return conn.execute(text(f'PRAGMA {statement}')).fetchall()
+
+def vacuum(max_pages=None, full=False):
+    """Give free pages back to the filesystem, returning (pages_before, pages_after).
+
+    Incremental vacuum only works once auto_vacuum=INCREMENTAL is set, which
+    takes one full VACUUM; full=True does that (or a plain full VACUUM) and
+    holds the write lock while it rewrites the whole file.
+    """
+    with autocommit() as conn:
+        before = pragma(conn, 'page_count')[0][0]
+        if full:
+            conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+            conn.execute(text('VACUUM'))
+        elif pragma(conn, 'auto_vacuum')[0][0] != 2:
+            raise RuntimeError('Incremental vacuum is off for this database, run with --full once to turn it on')
+        else:
+            # executescript steps the pragma to completion; a plain execute frees a single page
+            conn.connection.driver_connection.executescript(
+                f'PRAGMA incremental_vacuum({int(max_pages)})' if max_pages else 'PRAGMA incremental_vacuum')
+        return before, pragma(conn, 'page_count')[0][0]
+
+def analyze():
+    with autocommit() as conn:
+        conn.execute(text('ANALYZE'))
+
+def optimize():
+    """PRAGMA optimize: re-analyzes only the tables whose statistics look stale."""
+    with autocommit() as conn:
+        pragma(conn, 'optimize')
+
+def integrity_check(quick=False):
+    """Problems found by integrity_check (or quick_check) and foreign_key_check; empty when healthy."""
+    with autocommit() as conn:
+        problems = [row[0] for row in pragma(conn, 'quick_check' if quick else 'integrity_check') if row[0] != 'ok']
+        for table, rowid, parent, _ in pragma(conn, 'foreign_key_check'):
+            problems.append(f'{table} row {rowid} references a missing {parent} row')
+        return problems
+
+def checkpoint(mode='PASSIVE'):
+    """Copy the WAL back into the database file; (busy, wal_pages, checkpointed_pages), or None outside WAL mode."""
+    with autocommit() as conn:
+        if pragma(conn, 'journal_mode')[0][0] != 'wal':
+            return None
+        return tuple(pragma(conn, f'wal_checkpoint({mode})')[0])
+
+def table_stats():
+    """(table, rows, bytes) for every table, largest first; bytes is None without the dbstat extension."""
+    with autocommit() as conn:
+        tables = [row[0] for row in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"))]
+        try:
+            sizes = dict(conn.execute(text('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')).fetchall())
+        except Exception:
+            sizes = {}
+        stats = [(table, conn.execute(text(f'SELECT COUNT(*) FROM "{table}"')).scalar(), sizes.get(table))
+                 for table in tables]
+    return sorted(stats, key=lambda row: (row[2] or 0, row[1]), reverse=True)
+
+def file_stats():
+    with autocommit() as conn:
+        page_size = pragma(conn, 'page_size')[0][0]
+        return {
+            'pages': pragma(conn, 'page_count')[0][0],
+            'free_pages': pragma(conn, 'freelist_count')[0][0],
+            'page_size': page_size,
+            'journal_mode': pragma(conn, 'journal_mode')[0][0],
+            'auto_vacuum': {0: 'none', 1: 'full', 2: 'incremental'}[pragma(conn, 'auto_vacuum')[0][0]],
+        }
+
+def idle_maintenance():
+    """The cheap, bounded tasks the background scheduler runs when the app is idle."""
+    from services import purge_deleted, purge_cutoff
+    from idempotency import purge_expired_keys
+    purge_deleted(purge_cutoff(current_app.config['PURGE_DELETED_AFTER_DAYS']), max_batches=IDLE_PURGE_BATCHES)
+    purge_expired_keys()
+    optimize()
+    if file_stats()['auto_vacuum'] == 'incremental':
+        vacuum(IDLE_VACUUM_PAGES)
+    checkpoint('PASSIVE')
+
+class Activity:
+    """Requests in flight and when the last one finished, for this worker."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.last_seen = time.monotonic()
+
+    def started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finished(self, *args):
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.last_seen = time.monotonic()
+
+    def idle_for(self):
+        with self.lock:
+            return 0 if self.in_flight else time.monotonic() - self.last_seen
+
+activity = Activity()
+
+def track_activity(app):
+    app.before_request(activity.started)
+    app.teardown_request(activity.finished)
+
+class MaintenanceScheduler:
+    """Runs idle_maintenance() at most every interval seconds, once this worker has been idle for idle seconds.
+
+    Workers share a lock file next to the database, so only one of them runs
+    it at a time, and a stamp file whose mtime records the last run for all
+    of them. The thread lowers its own CPU priority where the OS allows it.
+    """
+
+    def __init__(self, app, interval, idle):
+        self.app = app
+        self.interval = interval
+        self.idle = idle
+        self.lock_path = os.path.join(app.instance_path, 'maintenance.lock')
+        self.stamp_path = os.path.join(app.instance_path, 'maintenance.last')
+        self.thread = threading.Thread(target=self.run, name='db-maintenance', daemon=True)
+        self.thread.start()
+
+    def due(self):
+        try:
+            return time.time() - os.path.getmtime(self.stamp_path) >= self.interval
+        except FileNotFoundError:
+            return True
+
+    def run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            time.sleep(min(self.idle, 60))
+            if activity.idle_for() < self.idle or not self.due():
+                continue
+            with open(self.lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                if not self.due():
+                    continue
+                try:
+                    with self.app.app_context():
+                        idle_maintenance()
+                except Exception:
+                    logger.exception('Background database maintenance failed')
+                with open(self.stamp_path, 'a'):
+                    os.utime(self.stamp_path)
+
+_scheduler = None
+_scheduler_pid = None
+
+def start_scheduler(app):
+    """Start this worker's maintenance thread if DB_MAINTENANCE_INTERVAL is set."""
+    global _scheduler, _scheduler_pid
+    interval = app.config['DB_MAINTENANCE_INTERVAL']
+    if interval and (_scheduler is None or _scheduler_pid != os.getpid()):
+        _scheduler = MaintenanceScheduler(app, interval, app.config['DB_MAINTENANCE_IDLE_SECONDS'])
+        _scheduler_pid = os.getpid()
+    return _scheduler
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app import db
+from models import Media
+
+def digest(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+class MediaCache:
+    """Per-worker id <-> url map of the media table.
+
+    Media rows are content-addressed and never updated, so a cached entry can
+    never go stale; unknown ids are picked up by loading the rows added since
+    the highest id seen.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.urls = {}
+        self.ids = {}
+        self.max_id = 0
+
+    def load(self):
+        with self.lock:
+            for media_id, key, url in db.session.query(Media.id, Media.digest, Media.url) \
+                    .filter(Media.id > self.max_id):
+                self.urls[media_id] = url
+                self.ids[key] = media_id
+                self.max_id = max(self.max_id, media_id)
+
+    def url(self, media_id):
+        if media_id is None:
+            return None
+        if media_id not in self.urls:
+            self.load()
+        return self.urls.get(media_id)
+
+    def urls_for(self, media_ids):
+        media_ids = {media_id for media_id in media_ids if media_id is not None}
+        if not media_ids <= self.urls.keys():
+            self.load()
+        return {media_id: self.urls[media_id] for media_id in media_ids if media_id in self.urls}
+
+    def id_for(self, url):
+        """The media id for url, adding a row in the current transaction if it is new."""
+        if not url:
+            return None
+        key = digest(url)
+        if key not in self.ids:
+            self.load()
+        if key in self.ids:
+            return self.ids[key]
+        db.session.execute(sqlite_insert(Media).values(digest=key, url=url)
+                           .on_conflict_do_nothing(index_elements=['digest']))
+        # Not cached here: the insert may still be rolled back, load() sees it once committed
+        return db.session.query(Media.id).filter_by(digest=key).scalar()
+
+_cache = None
+_cache_pid = None
+
+def get_media_cache():
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = MediaCache()
+        _cache_pid = os.getpid()
+    return _cache
+
+def media_url(media_id):
+    return get_media_cache().url(media_id)
+
+def media_urls(media_ids):
+    return get_media_cache().urls_for(media_ids)
+
+def media_id_for(url):
+    return get_media_cache().id_for(url)
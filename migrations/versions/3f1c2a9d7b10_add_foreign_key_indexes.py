@@ -0,0 +1,36 @@
+"""add foreign key indexes
+
+Revision ID: 3f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-19 17:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# The app runs db.create_all() before `flask db upgrade`, so fresh databases
+# already have these; only older files need them added.
+INDEXES = [
+    ('ix_class_cohort_id', 'class', 'cohort_id'),
+    ('ix_project_owner_id', 'project', 'owner_id'),
+    ('ix_project_class_id', 'project', 'class_id'),
+    ('ix_project_member_project_id', 'project_member', 'project_id'),
+    ('ix_project_member_user_id', 'project_member', 'user_id'),
+]
+
+
+def upgrade():
+    for name, table, column in INDEXES:
+        op.create_index(name, table, [column], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    for name, table, column in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
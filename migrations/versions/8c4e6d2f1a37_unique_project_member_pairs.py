@@ -0,0 +1,30 @@
+"""unique project member pairs
+
+Revision ID: 8c4e6d2f1a37
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-19 17:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e6d2f1a37'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the oldest row of every duplicated (project_id, user_id) pair
+    op.execute(
+        'DELETE FROM project_member WHERE id NOT IN '
+        '(SELECT MIN(id) FROM project_member GROUP BY project_id, user_id)'
+    )
+    op.create_index('uq_project_member_project_user', 'project_member', ['project_id', 'user_id'],
+                    unique=True, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('uq_project_member_project_user', table_name='project_member', if_exists=True)
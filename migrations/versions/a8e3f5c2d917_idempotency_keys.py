@@ -0,0 +1,36 @@
+"""idempotency keys
+
+Revision ID: a8e3f5c2d917
+Revises: f3a6c0d8b295
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8e3f5c2d917'
+down_revision = 'f3a6c0d8b295'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_key',
+        sa.Column('owner_id', sa.Integer(), primary_key=True),
+        sa.Column('key', sa.String(length=255), primary_key=True),
+        sa.Column('fingerprint', sa.LargeBinary(length=32), nullable=False),
+        sa.Column('status', sa.Integer()),
+        sa.Column('body', sa.LargeBinary()),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sqlite_with_rowid=False,
+        if_not_exists=True,
+    )
+    op.create_index('ix_idempotency_key_expires_at', 'idempotency_key', ['expires_at'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_idempotency_key_expires_at', table_name='idempotency_key', if_exists=True)
+    op.drop_table('idempotency_key', if_exists=True)
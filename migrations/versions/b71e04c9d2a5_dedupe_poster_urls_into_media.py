@@ -0,0 +1,69 @@
+"""dedupe poster urls into media
+
+Revision ID: b71e04c9d2a5
+Revises: 8c4e6d2f1a37
+Create Date: 2026-10-19 18:10:00.000000
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71e04c9d2a5'
+down_revision = '8c4e6d2f1a37'
+branch_labels = None
+depends_on = None
+
+POSTER_TABLES = ('cohort', 'class', 'project')
+
+
+def columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def drop_change_triggers(table):
+    # SQLite refuses to drop a column a trigger still mentions; the app
+    # reinstalls these from the live columns on its next start
+    for op_name in ('insert', 'update', 'delete'):
+        op.execute(f'DROP TRIGGER IF EXISTS change_{table}_{op_name}')
+
+
+def upgrade():
+    op.create_table(
+        'media',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('digest', sa.String(length=64), nullable=False, unique=True),
+        sa.Column('url', sa.Text(), nullable=False),
+        if_not_exists=True,
+    )
+    bind = op.get_bind()
+    for table in POSTER_TABLES:
+        if 'poster_url' not in columns(table):
+            continue
+        if 'poster_id' not in columns(table):
+            op.execute(f'ALTER TABLE "{table}" ADD COLUMN poster_id INTEGER REFERENCES media (id)')
+
+        urls = [url for (url,) in bind.execute(sa.text(
+            f'SELECT DISTINCT poster_url FROM "{table}" WHERE poster_url IS NOT NULL AND poster_url != \'\''))]
+        for url in urls:
+            bind.execute(sa.text('INSERT INTO media (digest, url) VALUES (:digest, :url) ON CONFLICT (digest) DO NOTHING'),
+                         {'digest': hashlib.sha256(url.encode()).hexdigest(), 'url': url})
+        op.execute(f'UPDATE "{table}" SET poster_id = (SELECT media.id FROM media WHERE media.url = "{table}".poster_url)')
+
+        drop_change_triggers(table)
+        op.execute(f'ALTER TABLE "{table}" DROP COLUMN poster_url')
+
+
+def downgrade():
+    for table in POSTER_TABLES:
+        if 'poster_id' not in columns(table):
+            continue
+        if 'poster_url' not in columns(table):
+            op.execute(f'ALTER TABLE "{table}" ADD COLUMN poster_url VARCHAR(200)')
+        op.execute(f'UPDATE "{table}" SET poster_url = (SELECT media.url FROM media WHERE media.id = "{table}".poster_id)')
+        drop_change_triggers(table)
+        op.execute(f'ALTER TABLE "{table}" DROP COLUMN poster_id')
+    op.drop_table('media', if_exists=True)
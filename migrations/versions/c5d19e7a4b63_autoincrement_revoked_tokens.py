@@ -0,0 +1,50 @@
+"""autoincrement revoked tokens
+
+Revision ID: c5d19e7a4b63
+Revises: a8e3f5c2d917
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d19e7a4b63'
+down_revision = 'a8e3f5c2d917'
+branch_labels = None
+depends_on = None
+
+
+def revoked_token_table(autoincrement):
+    return sa.Table(
+        'revoked_token', sa.MetaData(),
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('jti', sa.String(length=32), nullable=False, unique=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Index('ix_revoked_token_expires_at', 'expires_at'),
+        sqlite_autoincrement=autoincrement,
+    )
+
+
+def table_sql():
+    return op.get_bind().execute(sa.text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'revoked_token'")).scalar()
+
+
+def rebuild(autoincrement):
+    # SQLite can't add AUTOINCREMENT to an existing table, so the rows are copied into a new one
+    with op.batch_alter_table('revoked_token', recreate='always', copy_from=revoked_token_table(autoincrement)):
+        pass  # no column changes, the copy itself is the change
+
+
+def upgrade():
+    sql = table_sql()
+    if sql is not None and 'AUTOINCREMENT' not in sql.upper():
+        rebuild(True)
+
+
+def downgrade():
+    sql = table_sql()
+    if sql is not None and 'AUTOINCREMENT' in sql.upper():
+        rebuild(False)
@@ -0,0 +1,103 @@
+"""soft delete tombstones
+
+Revision ID: d42f9b7c1e86
+Revises: b71e04c9d2a5
+Create Date: 2026-10-19 19:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd42f9b7c1e86'
+down_revision = 'b71e04c9d2a5'
+branch_labels = None
+depends_on = None
+
+# Children first, the order tombstones have to be purged in
+SOFT_DELETE_TABLES = ('project_member', 'project', 'class', 'cohort', 'user')
+ARCHIVED_TABLES = ('cohort', 'class', 'project', 'project_member')
+
+LIVE = sa.text('deleted_at IS NULL')
+TOMBSTONED = sa.text('deleted_at IS NOT NULL')
+
+
+def columns(table, schema='main'):
+    return [row[1] for row in op.get_bind().execute(sa.text(f'PRAGMA {schema}.table_info("{table}")'))]
+
+
+def user_table():
+    # user's columns as create_all made them, minus the column-level UNIQUE constraints
+    metadata = sa.MetaData()
+    sa.Table('role', metadata, sa.Column('id', sa.Integer(), primary_key=True))
+    return sa.Table(
+        'user', metadata,
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(length=80), nullable=False),
+        sa.Column('password_hash', sa.String(length=120), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('role_id', sa.Integer(), sa.ForeignKey('role.id'), nullable=False),
+    )
+
+
+def drop_triggers():
+    # The rebuilt user table loses its triggers and SQLite refuses to drop a
+    # column a trigger mentions; the app reinstalls both sets on its next start
+    bind = op.get_bind()
+    for (name,) in bind.execute(sa.text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND (name LIKE 'stat_%' OR name LIKE 'change_%')")):
+        op.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def upgrade():
+    drop_triggers()
+    # SQLite can't turn a UNIQUE constraint into a partial index in place, so
+    # user is copied into a table without them (copy_from leaves them out)
+    if 'deleted_at' not in columns('user'):
+        with op.batch_alter_table('user', recreate='always', copy_from=user_table()) as batch_op:
+            batch_op.add_column(sa.Column('deleted_at', sa.DateTime()))
+    for table in SOFT_DELETE_TABLES:
+        if 'deleted_at' not in columns(table):
+            op.add_column(table, sa.Column('deleted_at', sa.DateTime()))
+        op.create_index(f'ix_{table}_deleted_at', table, ['deleted_at'], sqlite_where=TOMBSTONED, if_not_exists=True)
+
+    # Archived rows keep their tombstone column too, when the archive file already has its tables
+    for table in ARCHIVED_TABLES:
+        archived = columns(table, 'archive')
+        if archived and 'deleted_at' not in archived:
+            op.execute(f'ALTER TABLE archive."{table}" ADD COLUMN deleted_at DATETIME')
+
+    op.create_index('uq_user_username', 'user', ['username'], unique=True, sqlite_where=LIVE, if_not_exists=True)
+    op.create_index('uq_user_email', 'user', ['email'], unique=True, sqlite_where=LIVE, if_not_exists=True)
+    op.drop_index('uq_project_member_project_user', table_name='project_member', if_exists=True)
+    op.create_index('uq_project_member_project_user', 'project_member', ['project_id', 'user_id'],
+                    unique=True, sqlite_where=LIVE)
+
+
+def downgrade():
+    drop_triggers()
+    # Without the column there is no telling tombstones from live rows, so they go now
+    for table in SOFT_DELETE_TABLES:
+        if 'deleted_at' in columns(table):
+            op.execute(f'DELETE FROM "{table}" WHERE deleted_at IS NOT NULL')
+
+    op.drop_index('uq_project_member_project_user', table_name='project_member', if_exists=True)
+    op.create_index('uq_project_member_project_user', 'project_member', ['project_id', 'user_id'], unique=True)
+    op.drop_index('uq_user_username', table_name='user', if_exists=True)
+    op.drop_index('uq_user_email', table_name='user', if_exists=True)
+    for table in SOFT_DELETE_TABLES:
+        op.drop_index(f'ix_{table}_deleted_at', table_name=table, if_exists=True)
+        if table != 'user' and 'deleted_at' in columns(table):
+            op.execute(f'ALTER TABLE "{table}" DROP COLUMN deleted_at')
+    for table in ARCHIVED_TABLES:
+        if 'deleted_at' in columns(table, 'archive'):
+            op.execute(f'ALTER TABLE archive."{table}" DROP COLUMN deleted_at')
+
+    if 'deleted_at' in columns('user'):
+        copy_from = user_table()
+        copy_from.append_column(sa.Column('deleted_at', sa.DateTime()))
+        with op.batch_alter_table('user', recreate='always', copy_from=copy_from) as batch_op:
+            batch_op.drop_column('deleted_at')
+            batch_op.create_unique_constraint('uq_user_username', ['username'])
+            batch_op.create_unique_constraint('uq_user_email', ['email'])
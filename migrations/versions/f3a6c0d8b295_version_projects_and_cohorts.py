@@ -0,0 +1,50 @@
+"""version projects and cohorts
+
+Revision ID: f3a6c0d8b295
+Revises: d42f9b7c1e86
+Create Date: 2026-10-19 20:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a6c0d8b295'
+down_revision = 'd42f9b7c1e86'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ('project', 'cohort')
+
+
+def columns(table, schema='main'):
+    return [row[1] for row in op.get_bind().execute(sa.text(f'PRAGMA {schema}.table_info("{table}")'))]
+
+
+def drop_change_triggers(table):
+    # SQLite refuses to drop a column a trigger still mentions; the app
+    # reinstalls these from the live columns on its next start
+    for (name,) in op.get_bind().execute(sa.text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = :table AND name LIKE 'change_%'"),
+            {'table': table}):
+        op.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+def upgrade():
+    for table in VERSIONED_TABLES:
+        if 'version' not in columns(table):
+            op.execute(f'ALTER TABLE "{table}" ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+        # Archived rows carry the column too, when the archive file already has its tables
+        archived = columns(table, 'archive')
+        if archived and 'version' not in archived:
+            op.execute(f'ALTER TABLE archive."{table}" ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+
+def downgrade():
+    for table in VERSIONED_TABLES:
+        if 'version' in columns(table):
+            drop_change_triggers(table)
+            op.execute(f'ALTER TABLE "{table}" DROP COLUMN version')
+        if 'version' in columns(table, 'archive'):
+            op.execute(f'ALTER TABLE archive."{table}" DROP COLUMN version')
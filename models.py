@@ -1,13 +1,39 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship, validates
+import json
+from sqlalchemy import Column, Integer, String, ForeignKey, Index, Boolean, DateTime, Text, LargeBinary, Table, event, func, text
+from sqlalchemy.orm import Session, relationship, validates, with_loader_criteria
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db  # Import db from app.py after it's defined
 
-class User(db.Model):
+class SoftDeleteMixin:
+    """Rows are deleted by setting deleted_at; services.purge_deleted removes them for good later.
+
+    Every ORM SELECT leaves tombstoned rows out, unless it runs with
+    execution_options(include_deleted=True).
+    """
+    deleted_at = Column(DateTime)
+
+@event.listens_for(Session, 'do_orm_execute')
+def exclude_deleted(state):
+    if state.is_select and not state.execution_options.get('include_deleted', False):
+        state.statement = state.statement.options(with_loader_criteria(
+            SoftDeleteMixin, lambda cls: cls.deleted_at.is_(None), include_aliases=True))
+
+def tombstone_index(table):
+    # Only tombstones are indexed, so the purge finds them without the index growing with live rows
+    return Index(f'ix_{table}_deleted_at', 'deleted_at', sqlite_where=text('deleted_at IS NOT NULL'))
+
+class User(SoftDeleteMixin, db.Model):
+    __table_args__ = (
+        # Unique among live users only, so a deleted user's email and username can be taken again
+        Index('uq_user_username', 'username', unique=True, sqlite_where=text('deleted_at IS NULL')),
+        Index('uq_user_email', 'email', unique=True, sqlite_where=text('deleted_at IS NULL')),
+        tombstone_index('user'),
+    )
+
     id = Column(Integer, primary_key=True)
-    username = Column(String(80), unique=True, nullable=False)
+    username = Column(String(80), nullable=False)
     password_hash = Column(String(120), nullable=False)
-    email = Column(String(120), unique=True, nullable=False)
+    email = Column(String(120), nullable=False)
     role_id = Column(Integer, ForeignKey('role.id'), nullable=False)
     role = relationship('Role', back_populates='users')
     projects = relationship('Project', back_populates='owner')
@@ -38,51 +64,85 @@ class Role(db.Model):
             'name': self.name
         }
 
-class Cohort(db.Model):
+class Media(db.Model):
+    # Content-addressed: one row per distinct URL, never updated, so rows can be cached forever
+    id = Column(Integer, primary_key=True)
+    digest = Column(String(64), unique=True, nullable=False)  # sha256 of url
+    url = Column(Text, nullable=False)
+
+class PosterMixin:
+    # poster_url reads and writes go through the media table, the row only keeps poster_id
+    @property
+    def poster_url(self):
+        from media import media_url
+        return media_url(self.poster_id)
+
+    @poster_url.setter
+    def poster_url(self, url):
+        from media import media_id_for
+        self.poster_id = media_id_for(url)
+
+    def poster(self, media_refs):
+        return {'poster_id': self.poster_id} if media_refs else {'poster_url': self.poster_url}
+
+class Cohort(SoftDeleteMixin, PosterMixin, db.Model):
+    __table_args__ = (tombstone_index('cohort'),)
+
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
     description = Column(String(200))
-    poster_url = Column(String(200))
+    poster_id = Column(Integer, ForeignKey('media.id'))
+    # Bumped by every ORM update, which fails with StaleDataError if someone else bumped it first
+    version = Column(Integer, nullable=False, server_default='1')
     classes = relationship('Class', back_populates='cohort', cascade="all, delete-orphan")
+    __mapper_args__ = {'version_id_col': version}
 
-    def to_dict(self):
+    def to_dict(self, media_refs=False):
         return {
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'poster_url': self.poster_url
+            'version': self.version,
+            **self.poster(media_refs)
         }
 
-class Class(db.Model):
+class Class(SoftDeleteMixin, PosterMixin, db.Model):
+    __table_args__ = (tombstone_index('class'),)
+
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
     description = Column(String(200))
-    cohort_id = Column(Integer, ForeignKey('cohort.id'), nullable=False)
+    cohort_id = Column(Integer, ForeignKey('cohort.id'), nullable=False, index=True)
     cohort = relationship('Cohort', back_populates='classes')
-    poster_url = Column(String(200))
+    poster_id = Column(Integer, ForeignKey('media.id'))
     projects = relationship('Project', back_populates='class_', cascade="all, delete-orphan")
 
-    def to_dict(self):
+    def to_dict(self, media_refs=False):
         return {
             'id': self.id,
             'name': self.name,
             'description': self.description,
             'cohort_id': self.cohort_id,
-            'poster_url': self.poster_url
+            **self.poster(media_refs)
         }
 
 
-class Project(db.Model):
+class Project(SoftDeleteMixin, PosterMixin, db.Model):
+    __table_args__ = (tombstone_index('project'),)
+
     id = Column(Integer, primary_key=True)
     name = Column(String(120), nullable=False)
     description = Column(String(500))
-    owner_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    owner_id = Column(Integer, ForeignKey('user.id'), nullable=False, index=True)
     github_link = Column(String(200))
-    poster_url = Column(String(200))  # New column for poster URL
+    poster_id = Column(Integer, ForeignKey('media.id'))
     owner = relationship('User', back_populates='projects')
-    class_id = Column(Integer, ForeignKey('class.id'), nullable=False)
+    class_id = Column(Integer, ForeignKey('class.id'), nullable=False, index=True)
     class_ = relationship('Class', back_populates='projects')
     project_members = relationship('ProjectMember', back_populates='project')
+    # Bumped by every ORM update, which fails with StaleDataError if someone else bumped it first
+    version = Column(Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
     
     @validates('name')
     def validate_name(self, key, name):
@@ -102,7 +162,7 @@ class Project(db.Model):
             raise AssertionError('Project description must be at least 20 characters long')
         return description
 
-    def to_dict(self):
+    def to_dict(self, media_refs=False):
         return {
             'id': self.id,
             'name': self.name,
@@ -110,13 +170,21 @@ class Project(db.Model):
             'owner_id': self.owner_id,
             'github_link': self.github_link,
             'class_id': self.class_id,
-            'poster_url': self.poster_url  # Include poster_url in the dictionary
+            'version': self.version,
+            **self.poster(media_refs)
         }
 
-class ProjectMember(db.Model):
+class ProjectMember(SoftDeleteMixin, db.Model):
+    __table_args__ = (
+        # A user is a live member of a project at most once
+        Index('uq_project_member_project_user', 'project_id', 'user_id', unique=True,
+              sqlite_where=text('deleted_at IS NULL')),
+        tombstone_index('project_member'),
+    )
+
     id = Column(Integer, primary_key=True)
-    project_id = Column(Integer, ForeignKey('project.id'), nullable=False)
-    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    project_id = Column(Integer, ForeignKey('project.id'), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('user.id'), nullable=False, index=True)
     project = relationship('Project', back_populates='project_members')
     user = relationship('User', back_populates='project_memberships')
 
@@ -126,3 +194,123 @@ class ProjectMember(db.Model):
             'project_id': self.project_id,
             'user_id': self.user_id
         }
+
+# Archived cohort trees live in a separate SQLite file attached to every
+# connection under this schema name (see archive.py)
+ARCHIVE_SCHEMA = 'archive'
+
+def archived_table(table):
+    """Copy of table in the archive file: same columns and indexes, no foreign keys,
+    which SQLite can't enforce across files anyway."""
+    return Table(table.name, db.metadata,
+                 *[Column(column.name, column.type, primary_key=column.primary_key,
+                          nullable=column.nullable, index=column.index) for column in table.columns],
+                 schema=ARCHIVE_SCHEMA)
+
+class ArchivedCohort(SoftDeleteMixin, PosterMixin, db.Model):
+    __table__ = archived_table(Cohort.__table__)
+
+    def to_dict(self, media_refs=False):
+        return {**Cohort.to_dict(self, media_refs), 'archived': True}
+
+class ArchivedClass(SoftDeleteMixin, PosterMixin, db.Model):
+    __table__ = archived_table(Class.__table__)
+
+    def to_dict(self, media_refs=False):
+        return {**Class.to_dict(self, media_refs), 'archived': True}
+
+class ArchivedProject(SoftDeleteMixin, PosterMixin, db.Model):
+    __table__ = archived_table(Project.__table__)
+
+    def to_dict(self, media_refs=False):
+        return {**Project.to_dict(self, media_refs), 'archived': True}
+
+class ArchivedProjectMember(SoftDeleteMixin, db.Model):
+    __table__ = archived_table(ProjectMember.__table__)
+
+    def to_dict(self):
+        return {**ProjectMember.to_dict(self), 'archived': True}
+
+class StatCounter(db.Model):
+    # Maintained by the triggers in stats.py, one row per (kind, ref_id)
+    kind = Column(String(32), primary_key=True)
+    ref_id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+class ChangeLog(db.Model):
+    # Appended to by the triggers in changes.py; AUTOINCREMENT keeps seq monotonic even after compaction
+    __table_args__ = (
+        Index('ix_change_log_table_row', 'table_name', 'row_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = Column(Integer, primary_key=True)
+    table_name = Column(String(40), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    op = Column(String(10), nullable=False)
+    data = Column(Text)
+    created_at = Column(DateTime, nullable=False, server_default=func.current_timestamp())
+
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'table': self.table_name,
+            'id': self.row_id,
+            'op': self.op,
+            'data': json.loads(self.data) if self.data is not None else None,
+            'created_at': self.created_at.isoformat()
+        }
+
+class RevokedToken(db.Model):
+    # AUTOINCREMENT so ids freed by the purge aren't handed out again below a worker's last synced id
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(32), unique=True, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class IdempotencyKey(db.Model):
+    # The first response to each (user, Idempotency-Key) pair, replayed to retries until it expires (see idempotency.py)
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    owner_id = Column(Integer, primary_key=True)
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(LargeBinary(32), nullable=False)  # sha256 of method, path and body
+    status = Column(Integer)  # NULL while the first request is still running
+    body = Column(LargeBinary)
+    expires_at = Column(DateTime, nullable=False, index=True)  # lease deadline while running, then TTL
+
+class Job(db.Model):
+    # Lives in its own SQLite file so progress writes never wait on the app's write lock
+    __bind_key__ = 'jobs'
+
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(40), nullable=False)
+    params = Column(Text, nullable=False, default='{}')
+    status = Column(String(20), nullable=False, default='queued', index=True)
+    done = Column(Integer, nullable=False, default=0)
+    total = Column(Integer)
+    message = Column(String(200))
+    error = Column(Text)
+    result = Column(Text)
+    result_type = Column(String(80))
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    owner_id = Column(Integer)
+    pid = Column(Integer)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'message': self.message,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'has_result': self.result is not None,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
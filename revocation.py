@@ -0,0 +1,122 @@
+import datetime
+import hashlib
+import math
+import os
+import threading
+import time
+from app import db
+from models import RevokedToken
+
+SYNC_INTERVAL = 1.0
+REBUILD_INTERVAL = 3600
+INITIAL_CAPACITY = 10000
+FALSE_POSITIVE_RATE = 0.001
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing."""
+
+    def __init__(self, capacity, error_rate=FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationList:
+    """Per-worker view of revoked token IDs.
+
+    Lookups are answered from the Bloom filter; only a hit costs a primary-key
+    query to rule out a false positive. Other workers' revocations are pulled
+    in at most once per SYNC_INTERVAL by reading rows past the last seen id,
+    and the filter is rebuilt from unexpired rows every REBUILD_INTERVAL or
+    when it fills up.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.last_id = 0
+        self.synced_at = 0
+        self.rebuilt_at = 0
+
+    def rebuild(self):
+        now = datetime.datetime.utcnow()
+        rows = db.session.query(RevokedToken.id, RevokedToken.jti).filter(RevokedToken.expires_at > now).all()
+        bloom = BloomFilter(max(INITIAL_CAPACITY, 2 * len(rows)))
+        for _, jti in rows:
+            bloom.add(jti)
+        self.filter = bloom
+        self.last_id = db.session.query(db.func.max(RevokedToken.id)).scalar() or 0
+        self.rebuilt_at = self.synced_at = time.monotonic()
+
+    def sync(self):
+        now = time.monotonic()
+        if self.filter is not None and now - self.synced_at < SYNC_INTERVAL:
+            return
+        with self.lock:
+            if self.filter is None or now - self.rebuilt_at > REBUILD_INTERVAL:
+                self.rebuild()
+                return
+            if now - self.synced_at < SYNC_INTERVAL:
+                return
+            for row_id, jti in db.session.query(RevokedToken.id, RevokedToken.jti) \
+                    .filter(RevokedToken.id > self.last_id).order_by(RevokedToken.id):
+                self.filter.add(jti)
+                self.last_id = row_id
+            self.synced_at = now
+            if self.filter.count > self.filter.capacity:
+                self.rebuild()
+
+    def is_revoked(self, jti):
+        if not jti:
+            return False
+        self.sync()
+        if jti not in self.filter:
+            return False
+        return db.session.query(RevokedToken.id).filter_by(jti=jti).first() is not None
+
+    def revoke(self, jti, expires_at):
+        if db.session.query(RevokedToken.id).filter_by(jti=jti).first() is None:
+            db.session.add(RevokedToken(jti=jti, expires_at=expires_at))
+            db.session.commit()
+        self.sync()
+        with self.lock:
+            self.filter.add(jti)
+
+_revocations = None
+_revocations_pid = None
+
+def get_revocations():
+    """The revocation list of this worker process."""
+    global _revocations, _revocations_pid
+    if _revocations is None or _revocations_pid != os.getpid():
+        _revocations = RevocationList()
+        _revocations_pid = os.getpid()
+    return _revocations
+
+def is_revoked(jti):
+    return get_revocations().is_revoked(jti)
+
+def revoke_token(jti, expires_at):
+    get_revocations().revoke(jti, expires_at)
+
+def purge_expired():
+    """Delete revocations of tokens that have expired anyway."""
+    removed = db.session.query(RevokedToken) \
+        .filter(RevokedToken.expires_at <= datetime.datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
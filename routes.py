@@ -1,22 +1,64 @@
 import jwt
 import datetime
+import queue
+import uuid
 from functools import wraps
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, g, current_app, url_for, Response, abort
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.exc import StaleDataError
 from app import db
-from models import User, Project, Cohort, Class, ProjectMember, Role
+from models import User, Project, Cohort, Class, ProjectMember, Role, Job, ArchivedCohort, ArchivedClass, ArchivedProject
+from services import delete_users, delete_project_tree, delete_cohort_tree
+from jobs import submit_job, cancel_job
+from changes import changes_since, latest_seq
+from events import Subscription, get_notifier, format_event
+from routing import route_request, pin_to_primary, skip_pin, READ_METHODS
+from revocation import is_revoked, revoke_token
+from utils import Permission, role_required, has_permission, query_budget
+from idempotency import idempotent
+from schemas import (validate_body, UNSET, RegisterBody, LoginBody, NewProjectBody, ClassProjectBody, ProjectUpdateBody,
+                     NewCohortBody, CohortUpdateBody, NewClassBody, MembersBody, BatchBody, ExportBody, BackupBody,
+                     ImportUsersBody)
+from backups import list_backups
+from fragments import render_list, EMPTY_LISTS
+from media import media_url, media_urls
+from stats import read_counters, TOTAL_KINDS, COHORT_KINDS, CLASS_KINDS, PROJECT_KINDS
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS
 
 api_bp = Blueprint('api', __name__)
 CORS(api_bp)
 
+# Send reads to the replica when one is configured
+@api_bp.before_request
+def route_reads():
+    route_request(db.engines)
+
+@api_bp.after_request
+def pin_after_write(response):
+    return pin_to_primary(response, db.engines, current_app.config['READ_YOUR_WRITES_SECONDS'])
+
 # Secret key for JWT encoding and decoding
 SECRET_KEY = "your_secret_key_here"  # Replace with your actual secret key
 
 # Decorator to check for valid JWT token
 def token_required(f):
+    return authenticated(f)
+
+# Same, also taking the token as ?access_token= for EventSource clients, which can't send headers
+def token_or_query_required(f):
+    return authenticated(f, query_param='access_token')
+
+def authenticated(f, query_param=None):
     @wraps(f)
     def decorated(*args, **kwargs):
+        # Sub-requests of /batch reuse the user authenticated by the batch itself
+        batch_user = g.get('batch_user')
+        if batch_user is not None:
+            return f(batch_user, *args, **kwargs)
+
         token = None
         auth_header = request.headers.get('Authorization')
 
@@ -26,11 +68,15 @@ def token_required(f):
                 token = parts[1]
             else:
                 return jsonify({'message': 'Authorization header must be Bearer token!'}), 401
+        elif query_param and request.args.get(query_param):
+            token = request.args.get(query_param)
         else:
             return jsonify({'message': 'Authorization header is missing!'}), 401
 
         try:
             data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            if is_revoked(data.get('jti')):
+                return jsonify({'message': 'Token has been revoked!'}), 401
             current_user = User.query.filter_by(id=data['user_id']).first()
             if not current_user:
                 return jsonify({'message': 'User not found!'}), 404
@@ -43,35 +89,112 @@ def token_required(f):
 
     return decorated
 
+def project_summary(row):
+    return {
+        'id': row.id,
+        'name': row.name,
+        'class_id': row.class_id,
+        'owner_id': row.owner_id,
+        'poster_url': media_url(row.poster_id)
+    }
+
+# Paginate a query using the ?page= and ?per_page= arguments
+def paginated(query, serialize, default_per_page=50, max_per_page=200):
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    result = query.paginate(page=page, per_page=per_page, max_per_page=max_per_page, error_out=False)
+    return jsonify({
+        'items': [serialize(row) for row in result.items],
+        'page': result.page,
+        'per_page': result.per_page,
+        'total': result.total
+    }), 200
+
+MAX_IDS = 200
+
+# Parse the optional ?ids=1,2,3 argument, returning (ids, error_response)
+def requested_ids():
+    raw = request.args.get('ids')
+    if raw is None:
+        return None, None
+    try:
+        ids = sorted({int(part) for part in raw.split(',') if part.strip()})
+    except ValueError:
+        return None, (jsonify({'error': 'ids must be a comma separated list of integers'}), 400)
+    if len(ids) > MAX_IDS:
+        return None, (jsonify({'error': f'At most {MAX_IDS} ids per request'}), 400)
+    return ids, None
+
+# 202 response pointing at a queued background job
+def accepted(job):
+    status_url = url_for('api.get_job', job_id=job.id)
+    response = jsonify({'job_id': job.id, 'status': job.status, 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+# Response for a JSON array already encoded by the fragment cache
+def json_list(body):
+    return Response(body + b'\n', mimetype='application/json')
+
+# A versioned row's version as the response's ETag, for If-Match on the next update
+def with_etag(response, row):
+    response.set_etag(str(row.version))
+    return response
+
+# 412 telling the client its copy of row is out of date
+def precondition_failed(row):
+    response = jsonify({'error': f'{type(row).__name__} was changed by someone else, reload it and retry',
+                        'version': row.version})
+    return with_etag(response, row), 412
+
+# The 412 response unless If-Match is absent, * or names row's current version
+def check_if_match(row):
+    if request.if_match and not request.if_match.contains(str(row.version)):
+        return precondition_failed(row)
+    return None
+
+# Assign only the fields of data that differ from row's, returning their names
+def apply_changes(row, data, fields):
+    changed = [field for field in fields if field in data and data[field] != getattr(row, field)]
+    for field in changed:
+        setattr(row, field, data[field])
+    return changed
+
+# ?media=refs: rows carry poster_id and the poster URLs are sent once per response
+def media_refs():
+    return request.args.get('media') == 'refs'
+
+# A query-string flag like ?include_archived=1 or ?async=true; absent, 0 or false is off
+def query_flag(name):
+    return request.args.get(name) in ('1', 'true')
+
+# ?include_archived=1: also read rows of archived cohorts from the archive file
+def include_archived():
+    return query_flag('include_archived')
+
 # Test Route
 @api_bp.route('/test', methods=['GET'])
+@query_budget(2)
 def test():
     return jsonify({'message': 'API is working!'}), 200
 
 # Register Route
 @api_bp.route('/register', methods=['POST'])
-def register():
-    data = request.get_json()
-    username = data.get('username')
-    email = data.get('email')
-    password = data.get('password')
-    role_id = data.get('role_id')  # role_id should be passed from the frontend
-
-    if not username or not email or not password or not role_id:
-        return jsonify({'error': 'Missing required fields'}), 400
-
-    existing_user = User.query.filter_by(email=email).first()
+@query_budget(5)
+@validate_body(RegisterBody)
+def register(body):
+    existing_user = User.query.filter_by(email=body.email).first()
     if existing_user:
         return jsonify({'error': 'User already exists'}), 400
 
     try:
-        role = Role.query.get(role_id)
+        role = Role.query.get(body.role_id)  # role_id should be passed from the frontend
         
         if not role:
             return jsonify({'error': 'Role not found'}), 500
 
-        new_user = User(username=username, email=email, role_id=role.id)
-        new_user.set_password(password)
+        new_user = User(username=body.username, email=body.email, role_id=role.id)
+        new_user.set_password(body.password)
 
         db.session.add(new_user)
         db.session.commit()
@@ -82,89 +205,99 @@ def register():
 
 # Login Route
 @api_bp.route('/login', methods=['POST'])
-def login():
-    data = request.get_json()
-    email = data.get('email')
-    password = data.get('password')
-
-    if not email or not password:
-        return jsonify({'error': 'Missing required fields'}), 400
-
-    user = User.query.filter_by(email=email).first()
-    if not user or not user.check_password(password):
+@query_budget(3)
+@validate_body(LoginBody)
+def login(body):
+    user = User.query.filter_by(email=body.email).first()
+    if not user or not user.check_password(body.password):
         return jsonify({'error': 'Invalid credentials'}), 401
 
     token = jwt.encode({
         'user_id': user.id,
+        'jti': uuid.uuid4().hex,
         'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
     }, SECRET_KEY, algorithm="HS256")
 
-    return jsonify({'token': token, 'is_admin': user.role.name == 'admin'}), 200
+    return jsonify({'token': token, 'is_admin': has_permission(user, Permission.ADMIN)}), 200
 
 # Check if Admin Route
 @api_bp.route('/check_admin', methods=['GET'])
+@query_budget(3)
 @token_required
 def check_admin(current_user):
-    if current_user.role.name == 'admin':
-        return jsonify({'is_admin': True}), 200
-    return jsonify({'is_admin': False}), 200
+    return jsonify({'is_admin': has_permission(current_user, Permission.ADMIN)}), 200
 
 # Logout Route
 @api_bp.route('/logout', methods=['POST'])
+@query_budget(4)
 def logout():
     session.pop('user_id', None)
     session.pop('is_admin', None)
+
+    # Revoke the presented token so it can't be used again before it expires
+    parts = request.headers.get('Authorization', '').split()
+    if len(parts) == 2 and parts[0] == 'Bearer':
+        try:
+            data = jwt.decode(parts[1], SECRET_KEY, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            data = {}
+        if data.get('jti'):
+            revoke_token(data['jti'], datetime.datetime.utcfromtimestamp(data['exp']))
     return jsonify({'message': 'Logout successful'}), 200
 
 # Get All Projects
 @api_bp.route('/projects', methods=['GET'])
+@query_budget(6)
 def get_projects():
-    projects = Project.query.all()
-    return jsonify([project.to_dict() for project in projects]), 200
+    ids, error = requested_ids()
+    if error:
+        return error
+    query = Project.query
+    archived = ArchivedProject.query if include_archived() else None
+    if ids is not None:
+        query = query.filter(Project.id.in_(ids))
+        archived = archived.filter(ArchivedProject.id.in_(ids)) if archived is not None else None
+    return json_list(render_list(Project, query, media_refs(), archived)), 200
 # Delete a User
 @api_bp.route('/users/<int:user_id>', methods=['DELETE'])
+@query_budget(9)
 @token_required
+@role_required(Permission.MANAGE_USERS)
 def delete_user(current_user, user_id):
-    user = User.query.get_or_404(user_id)
-    
+    User.query.get_or_404(user_id)
+
     try:
-        db.session.delete(user)
-        db.session.commit()
+        delete_users([user_id], request.args.get('reassign_to'))
         return jsonify({'message': 'User deleted successfully'}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': 'Failed to delete user', 'details': str(e)}), 500
 
 # Get Projects By Class
 @api_bp.route('/classes/<int:class_id>/projects', methods=['GET'])
+@query_budget(4)
 def get_projects_by_class(class_id):
-    projects = Project.query.filter_by(class_id=class_id).all()
-    return jsonify([project.to_dict() for project in projects]), 200
+    archived = ArchivedProject.query.filter_by(class_id=class_id) if include_archived() else None
+    return json_list(render_list(Project, Project.query.filter_by(class_id=class_id), media_refs(), archived)), 200
 
 # Post a Project by Class
 @api_bp.route('/classes/<int:class_id>/projects', methods=['POST'])
-def add_project(class_id):
-    data = request.json
+@query_budget(5)
+@token_required
+@role_required(Permission.CREATE_PROJECT)
+@validate_body(ClassProjectBody)
+@idempotent
+def add_project(current_user, class_id, body):
     try:
-        # Extract data from request
-        name = data.get('name')
-        description = data.get('description')
-        github_link = data.get('github_link')
-        poster_url = data.get('poster_url')
-        owner_id = data.get('owner_id')  # Ensure owner_id is extracted
-
-        # Validate required fields
-        if not name or not description or not github_link or not poster_url or not owner_id:
-            return jsonify({'error': 'Missing required fields'}), 400
-
         # Create a new project instance
         new_project = Project(
-            name=name,
-            description=description,
-            github_link=github_link,
-            poster_url=poster_url,
+            name=body.name,
+            description=body.description,
+            github_link=body.github_link,
+            poster_url=body.poster_url,
             class_id=class_id,
-            owner_id=owner_id  # Associate the owner of the project
+            owner_id=body.owner_id  # Associate the owner of the project
         )
         
         # Add the new project to the database
@@ -180,32 +313,30 @@ def add_project(class_id):
 
 # Get Single Project
 @api_bp.route('/projects/<int:project_id>', methods=['GET'])
+@query_budget(3)
 def get_project(project_id):
-    project = Project.query.get_or_404(project_id)
-    return jsonify(project.to_dict()), 200
+    project = db.session.get(Project, project_id)
+    if project is None and include_archived():
+        project = db.session.get(ArchivedProject, project_id)
+    if project is None:
+        abort(404)
+    return with_etag(jsonify(project.to_dict()), project), 200
 
 # Create New Project
 @api_bp.route('/projects', methods=['POST'])
+@query_budget(9)
 @token_required
-def create_project(current_user):
-    data = request.get_json()
-    name = data.get('name')
-    description = data.get('description')
-    github_link = data.get('github_link')
-    owner_id = data.get('owner_id')
-    class_id = data.get('class_id')
-    poster_url = data.get('poster_url', '')
-
-    if not name or not description or not owner_id or not class_id:
-        return jsonify({'error': 'Missing required fields'}), 400
-
+@role_required(Permission.CREATE_PROJECT)
+@validate_body(NewProjectBody)
+@idempotent
+def create_project(current_user, body):
     new_project = Project(
-        name=name,
-        description=description,
-        owner_id=owner_id,
-        github_link=github_link,
-        class_id=class_id,
-        poster_url=poster_url
+        name=body.name,
+        description=body.description,
+        owner_id=body.owner_id,
+        github_link=body.github_link,
+        class_id=body.class_id,
+        poster_url=body.poster_url
     )
 
     try:
@@ -216,64 +347,70 @@ def create_project(current_user):
         db.session.rollback()
         return jsonify({'error': 'Failed to create project', 'details': str(e)}), 500
 
+# Fields a project PUT may change
+PROJECT_FIELDS = ('name', 'description', 'github_link', 'poster_url', 'class_id', 'owner_id')
+
 # Update a Project
 @api_bp.route('/projects/<int:project_id>', methods=['PUT'])
+@query_budget(6)
 @token_required
-def update_project(current_user, project_id):
+@role_required(Permission.EDIT_PROJECT)
+@validate_body(ProjectUpdateBody)
+def update_project(current_user, project_id, body):
     project = Project.query.get_or_404(project_id)
+    stale = check_if_match(project)
+    if stale:
+        return stale
 
-    data = request.get_json()
-    project.name = data.get('name', project.name)
-    project.description = data.get('description', project.description)
-    project.github_link = data.get('github_link', project.github_link)
-    project.poster_url = data.get('poster_url', project.poster_url)
-    project.class_id = data.get('class_id', project.class_id)  # Update class_id if provided
-    project.owner_id = data.get('owner_id', project.owner_id)  # Update owner_id if provided
+    # An unchanged PUT takes no write lock, and without a change_log entry no cache is invalidated
+    if not apply_changes(project, body.to_dict(), PROJECT_FIELDS):
+        skip_pin()
+        return with_etag(jsonify(project.to_dict()), project), 200
 
-
-    db.session.commit()
-    return jsonify(project.to_dict()), 200
+    try:
+        db.session.commit()
+    except StaleDataError:
+        # Someone else committed between our read and our UPDATE ... WHERE version = ?
+        db.session.rollback()
+        return precondition_failed(project)
+    return with_etag(jsonify(project.to_dict()), project), 200
 
 # Delete a Project
 @api_bp.route('/projects/<int:project_id>', methods=['DELETE'])
+@query_budget(6)
 @token_required
+@role_required(Permission.DELETE_PROJECT)
 def delete_project(current_user, project_id):
     project = Project.query.get_or_404(project_id)
     try:
-        db.session.delete(project)
-        db.session.commit()
+        # Tombstoned with its memberships; the purge removes them later
+        delete_project_tree(project.id)
         return jsonify({'message': 'Project deleted successfully'}), 200
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': 'Failed to delete project', 'details': str(e)}), 500
 
 # Get All Cohorts
 @api_bp.route('/cohorts', methods=['GET'])
+@query_budget(5)
 def get_cohorts():
     print("Cohorts endpoint hit")  # Debug statement
-    cohorts = Cohort.query.all()
-    if not cohorts:
+    body = render_list(Cohort, Cohort.query, media_refs(), ArchivedCohort.query if include_archived() else None)
+    if body in EMPTY_LISTS:
         return jsonify({"message": "No cohorts found"}), 404
 
-    return jsonify([{
-        'id': cohort.id,
-        'name': cohort.name,
-        'description': cohort.description,
-        'poster_url': cohort.poster_url
-    } for cohort in cohorts]), 200
+    return json_list(body), 200
 
 # Create New Cohort with Classes
 @api_bp.route('/cohorts', methods=['POST'])
+@query_budget(6)
 @token_required
-def create_cohort(current_user):
-    data = request.get_json()
-    name = data.get('name')
-    description = data.get('description')
-    classes = data.get('classes', [])
-
+@role_required(Permission.MANAGE_COHORTS)
+@validate_body(NewCohortBody)
+@idempotent
+def create_cohort(current_user, body):
     new_cohort = Cohort(
-        name=name,
-        description=description
+        name=body.name,
+        description=body.description
     )
 
     try:
@@ -281,10 +418,10 @@ def create_cohort(current_user):
         db.session.flush()  # Flush to get the cohort id before committing
 
         # Add classes to the cohort
-        for cls in classes:
+        for cls in body.classes:
             new_class = Class(
-                name=cls.get('name'),
-                description=cls.get('description'),
+                name=cls.name,
+                description=cls.description,
                 cohort_id=new_cohort.id
             )
             db.session.add(new_class)
@@ -295,88 +432,110 @@ def create_cohort(current_user):
         db.session.rollback()
         return jsonify({'error': 'Failed to create cohort with classes', 'details': str(e)}), 500
 
+# Fields a cohort PUT may change, on the cohort and on each of its classes
+COHORT_FIELDS = ('name', 'description')
+CLASS_FIELDS = ('name', 'description')
+
 # Update Cohort
 @api_bp.route('/cohorts/<int:cohort_id>', methods=['PUT'])
+@query_budget(7)
 @token_required
-def update_cohort(current_user, cohort_id):
+@role_required(Permission.MANAGE_COHORTS)
+@validate_body(CohortUpdateBody)
+def update_cohort(current_user, cohort_id, body):
     cohort = Cohort.query.get_or_404(cohort_id)
-    data = request.get_json()
+    stale = check_if_match(cohort)
+    if stale:
+        return stale
+
+    existing_classes = {cls.id: cls for cls in cohort.classes}
+    if any(cls_data.id not in existing_classes and not cls_data.name for cls_data in body.classes):
+        return jsonify({'error': 'Invalid request body', 'details': 'classes: a new class needs a name'}), 400
 
     # Update cohort details
-    cohort.name = data.get('name', cohort.name)
-    cohort.description = data.get('description', cohort.description)
+    changed = apply_changes(cohort, body.to_dict(), COHORT_FIELDS)
 
     # Check if there are classes to update or add
-    classes = data.get('classes', [])
-    existing_class_ids = [cls.id for cls in cohort.classes]
-
-    for cls_data in classes:
-        class_id = cls_data.get('id')
-        if class_id and class_id in existing_class_ids:
+    for cls_data in body.classes:
+        cls = existing_classes.get(cls_data.id)
+        if cls is not None:
             # Update existing class
-            cls = Class.query.get(class_id)
-            cls.name = cls_data.get('name', cls.name)
-            cls.description = cls_data.get('description', cls.description)
+            changed += apply_changes(cls, cls_data.to_dict(), CLASS_FIELDS)
         else:
             # Add new class
             new_class = Class(
-                name=cls_data.get('name'),
-                description=cls_data.get('description'),
+                name=cls_data.name,
+                description=None if cls_data.description is UNSET else cls_data.description,
                 cohort_id=cohort_id
             )
             db.session.add(new_class)
+            changed.append('classes')
+
+    if not changed:
+        skip_pin()
+        return with_etag(jsonify(cohort.to_dict()), cohort), 200
+    # The cohort's version covers its classes, so a class-only edit bumps it too
+    flag_modified(cohort, 'name')
 
     try:
         db.session.commit()
-        return jsonify(cohort.to_dict()), 200
+        return with_etag(jsonify(cohort.to_dict()), cohort), 200
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed(cohort)
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to update cohort', 'details': str(e)}), 500
 
 # Delete Cohort
 @api_bp.route('/cohorts/<int:cohort_id>', methods=['DELETE'])
+@query_budget(8)
 @token_required
+@role_required(Permission.MANAGE_COHORTS)
 def delete_cohort(current_user, cohort_id):
     cohort = Cohort.query.get_or_404(cohort_id)
-    
+
+    # Big cohorts can outlive the worker timeout, so let the client ask for a job instead
+    if query_flag('async'):
+        return accepted(submit_job('delete_cohort', {'cohort_id': cohort_id}, current_user.id))
+
     try:
-        # Manually delete all classes and their projects before deleting the cohort
-        for cls in cohort.classes:
-            for project in cls.projects:
-                db.session.delete(project)
-            db.session.delete(cls)
-        
-        db.session.delete(cohort)
-        db.session.commit()
+        # Classes, their projects and memberships are tombstoned with the cohort, in bulk
+        delete_cohort_tree(cohort.id)
         return jsonify({'message': 'Cohort and its associated classes and projects deleted successfully'}), 200
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': 'Failed to delete cohort', 'details': str(e)}), 500
 
 # Get All Classes
 @api_bp.route('/classes', methods=['GET'])
+@query_budget(5)
 def get_classes():
+    ids, error = requested_ids()
+    if error:
+        return error
+    query = Class.query
+    archived = ArchivedClass.query if include_archived() else None
     cohort_id = request.args.get('cohort_id')
     if cohort_id:
-        classes = Class.query.filter_by(cohort_id=cohort_id).all()
-    else:
-        classes = Class.query.all()
+        query = query.filter_by(cohort_id=cohort_id)
+        archived = archived.filter_by(cohort_id=cohort_id) if archived is not None else None
+    if ids is not None:
+        query = query.filter(Class.id.in_(ids))
+        archived = archived.filter(ArchivedClass.id.in_(ids)) if archived is not None else None
 
-    return jsonify([cls.to_dict() for cls in classes]), 200
+    return json_list(render_list(Class, query, media_refs(), archived)), 200
 
 # Create New Class
 @api_bp.route('/classes', methods=['POST'])
+@query_budget(5)
 @token_required
-def create_class(current_user):
-    data = request.get_json()
-    name = data.get('name')
-    description = data.get('description')
-    cohort_id = data.get('cohort_id')
-
+@role_required(Permission.MANAGE_COHORTS)
+@validate_body(NewClassBody)
+def create_class(current_user, body):
     new_class = Class(
-        name=name,
-        description=description,
-        cohort_id=cohort_id
+        name=body.name,
+        description=body.description,
+        cohort_id=body.cohort_id
     )
     db.session.add(new_class)
     db.session.commit()
@@ -384,32 +543,110 @@ def create_class(current_user):
 
 # Get All Project Members
 @api_bp.route('/project_members', methods=['GET'])
+@query_budget(4)
 @token_required
 def get_project_members(current_user):
-    project_members = ProjectMember.query.all()
-    return jsonify([pm.to_dict() for pm in project_members]), 200
-
-# Create a Project Member
+    query = ProjectMember.query
+    project_id = request.args.get('project_id', type=int)
+    user_id = request.args.get('user_id', type=int)
+    if project_id is not None:
+        query = query.filter_by(project_id=project_id)
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    return jsonify([pm.to_dict() for pm in query.all()]), 200
+
+# Get a Project's Members
+@api_bp.route('/projects/<int:project_id>/members', methods=['GET'])
+@query_budget(6)
+@token_required
+def get_members_of_project(current_user, project_id):
+    Project.query.get_or_404(project_id)
+    query = db.session.query(ProjectMember.id, ProjectMember.user_id, User.username, User.email) \
+        .join(User, User.id == ProjectMember.user_id) \
+        .filter(ProjectMember.project_id == project_id) \
+        .order_by(ProjectMember.id)
+    return paginated(query, lambda row: {
+        'id': row.id,
+        'project_id': project_id,
+        'user_id': row.user_id,
+        'user': {'id': row.user_id, 'username': row.username, 'email': row.email}
+    })
+
+# Get a User's Projects
+@api_bp.route('/users/<int:user_id>/projects', methods=['GET'])
+@query_budget(6)
+@token_required
+def get_projects_of_user(current_user, user_id):
+    User.query.get_or_404(user_id)
+    columns = (Project.id, Project.name, Project.class_id, Project.owner_id, Project.poster_id)
+    relation = request.args.get('relation', 'member')
+
+    if relation == 'owner':
+        query = db.session.query(*columns).filter(Project.owner_id == user_id).order_by(Project.id)
+        return paginated(query, project_summary)
+    if relation != 'member':
+        return jsonify({'error': 'relation must be "member" or "owner"'}), 400
+
+    query = db.session.query(ProjectMember.id.label('membership_id'), *columns) \
+        .join(Project, Project.id == ProjectMember.project_id) \
+        .filter(ProjectMember.user_id == user_id) \
+        .order_by(ProjectMember.id)
+    return paginated(query, lambda row: {
+        'id': row.membership_id,
+        'project_id': row.id,
+        'user_id': user_id,
+        'project': project_summary(row)
+    })
+
+# Create Project Members
+# Accepts one {"project_id", "user_id"} object or a list of them. Pairs that
+# already exist are left alone and reported back instead of duplicated.
 @api_bp.route('/project_members', methods=['POST'])
+@query_budget(4)
 @token_required
-def create_project_member(current_user):
-    data = request.get_json()
-    project_id = data.get('project_id')
-    user_id = data.get('user_id')
-
-    new_project_member = ProjectMember(
-        project_id=project_id,
-        user_id=user_id
-    )
-    db.session.add(new_project_member)
-    db.session.commit()
-    return jsonify(new_project_member.to_dict()), 201
+@role_required(Permission.MANAGE_MEMBERS)
+@validate_body(MembersBody)
+@idempotent
+def create_project_member(current_user, body):
+    pairs = []
+    for item in body if isinstance(body, list) else [body]:
+        if (item.project_id, item.user_id) not in pairs:
+            pairs.append((item.project_id, item.user_id))
+
+    statement = sqlite_insert(ProjectMember) \
+        .values([{'project_id': project_id, 'user_id': user_id} for project_id, user_id in pairs]) \
+        .on_conflict_do_nothing(index_elements=['project_id', 'user_id'], index_where=ProjectMember.deleted_at.is_(None)) \
+        .returning(ProjectMember.id, ProjectMember.project_id, ProjectMember.user_id)
+    try:
+        created = {(row.project_id, row.user_id): row.id for row in db.session.execute(statement)}
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to add project members', 'details': str(e)}), 500
+
+    if not isinstance(body, list):
+        project_id, user_id = pairs[0]
+        member_id = created.get(pairs[0]) or db.session.query(ProjectMember.id) \
+            .filter_by(project_id=project_id, user_id=user_id).scalar()
+        return jsonify({'id': member_id, 'project_id': project_id, 'user_id': user_id}), 201 if created else 200
+
+    return jsonify({
+        'created': [{'id': created[pair], 'project_id': pair[0], 'user_id': pair[1]} for pair in pairs if pair in created],
+        'existing': [{'project_id': pair[0], 'user_id': pair[1]} for pair in pairs if pair not in created]
+    }), 201 if created else 200
 
 # Get All Users
 @api_bp.route('/users', methods=['GET'])
+@query_budget(4)
 @token_required
 def get_users(current_user):
-    users = User.query.all()
+    ids, error = requested_ids()
+    if error:
+        return error
+    query = User.query.options(joinedload(User.role))
+    if ids is not None:
+        query = query.filter(User.id.in_(ids))
+    users = query.all()
     return jsonify([{
         'id': user.id,
         'username': user.username,
@@ -419,6 +656,7 @@ def get_users(current_user):
 
 # Get Single User
 @api_bp.route('/users/<int:user_id>', methods=['GET'])
+@query_budget(5)
 @token_required
 def get_user(current_user, user_id):
     user = User.query.get_or_404(user_id)
@@ -428,3 +666,254 @@ def get_user(current_user, user_id):
         'email': user.email,
         'role': user.role.name
     }), 200
+
+# Get Poster URLs by Media ID
+# Media rows never change, so clients can cache an id's URL for good
+@api_bp.route('/media', methods=['GET'])
+@query_budget(3)
+def get_media():
+    ids, error = requested_ids()
+    if error:
+        return error
+    if ids is None:
+        return jsonify({'error': 'ids is required'}), 400
+    response = jsonify(media_urls(ids))
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response, 200
+
+# Get Overall Statistics
+@api_bp.route('/stats', methods=['GET'])
+@query_budget(3)
+def get_stats():
+    return jsonify(read_counters(TOTAL_KINDS)), 200
+
+# Get Cohort Statistics
+@api_bp.route('/stats/cohorts/<int:cohort_id>', methods=['GET'])
+@query_budget(4)
+def get_cohort_stats(cohort_id):
+    Cohort.query.get_or_404(cohort_id)
+    counters = read_counters(COHORT_KINDS, cohort_id)
+    return jsonify({
+        'cohort_id': cohort_id,
+        'classes': counters['cohort_classes'],
+        'projects': counters['cohort_projects']
+    }), 200
+
+# Get Class Statistics
+@api_bp.route('/stats/classes/<int:class_id>', methods=['GET'])
+@query_budget(4)
+def get_class_stats(class_id):
+    Class.query.get_or_404(class_id)
+    counters = read_counters(CLASS_KINDS, class_id)
+    return jsonify({
+        'class_id': class_id,
+        'projects': counters['class_projects'],
+        'members': counters['class_members']
+    }), 200
+
+# Get Project Statistics
+@api_bp.route('/stats/projects/<int:project_id>', methods=['GET'])
+@query_budget(4)
+def get_project_stats(project_id):
+    Project.query.get_or_404(project_id)
+    counters = read_counters(PROJECT_KINDS, project_id)
+    return jsonify({
+        'project_id': project_id,
+        'members': counters['project_members']
+    }), 200
+
+# Run Several API Requests At Once
+@api_bp.route('/batch', methods=['POST'])
+@query_budget(6)  # the sample batch of two GETs
+@token_required
+@validate_body(BatchBody)
+def batch(current_user, body):
+    responses = []
+    g.batch_user = current_user
+    try:
+        for sub in body.requests:
+            method = sub.method.upper()
+            path = sub.path
+            route = path.split('?')[0].rstrip('/')
+            if not path.startswith(request.script_root + '/api/') or route.endswith(('/batch', '/events')):
+                responses.append({'status': 400, 'body': {'error': 'path must be an API route other than /batch and /events'}})
+                continue
+
+            # Sub-requests share this app context, its DB session and the authenticated user
+            try:
+                with current_app.test_request_context(path, method=method, json=sub.body,
+                                                      environ_base={'REMOTE_ADDR': request.remote_addr}):
+                    response = current_app.full_dispatch_request()
+            except Exception:
+                # Earlier sub-requests have committed already; report this one and go on
+                current_app.logger.exception('Batch sub-request %s %s failed', method, path)
+                db.session.rollback()
+                responses.append({'status': 500, 'body': {'error': 'Internal server error'}})
+            else:
+                responses.append({'status': response.status_code, 'body': response.get_json(silent=True)})
+                response.close()
+            if method not in READ_METHODS:
+                # Later reads in this batch must see what this one wrote, so they stay on the primary
+                g.batch_wrote = True
+    finally:
+        g.pop('batch_user', None)
+        g.pop('batch_wrote', None)
+
+    return jsonify({'responses': responses}), 200
+
+# Start a Full Export Job
+@api_bp.route('/exports', methods=['POST'])
+@query_budget(6)
+@token_required
+@role_required(Permission.EXPORT_DATA)
+@validate_body(ExportBody, optional=True)
+def create_export(current_user, body):
+    return accepted(submit_job('export', {'tables': list(body.tables)}, current_user.id))
+
+# Start a Bulk User Import Job
+@api_bp.route('/users/import', methods=['POST'])
+@query_budget(5)
+@token_required
+@role_required(Permission.MANAGE_USERS)
+@validate_body(ImportUsersBody)
+def import_users(current_user, body):
+    return accepted(submit_job('import_users', {'users': body}, current_user.id))
+
+# Start an Online Database Backup Job
+@api_bp.route('/backups', methods=['POST'])
+@query_budget(6)
+@token_required
+@role_required(Permission.ADMIN)
+@validate_body(BackupBody, optional=True)
+def create_backup(current_user, body):
+    return accepted(submit_job('backup', {'compress': body.compress}, current_user.id))
+
+# List Database Backups
+@api_bp.route('/backups', methods=['GET'])
+@query_budget(3)
+@token_required
+@role_required(Permission.ADMIN)
+def get_backups(current_user):
+    return jsonify([
+        {'name': name, 'bytes': size, 'created_at': created.isoformat()}
+        for name, size, created in list_backups()
+    ]), 200
+
+# Jobs are visible to whoever started them and to admins
+def get_job_or_404(current_user, job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.owner_id != current_user.id and not has_permission(current_user, Permission.ADMIN):
+        return None
+    return job
+
+# Get Job Progress
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+@query_budget(4)
+@token_required
+def get_job(current_user, job_id):
+    job = get_job_or_404(current_user, job_id)
+    if job is None:
+        return jsonify({'error': 'Access forbidden'}), 403
+    return jsonify(job.to_dict()), 200
+
+# Download Job Result
+@api_bp.route('/jobs/<job_id>/result', methods=['GET'])
+@query_budget(4)
+@token_required
+def get_job_result(current_user, job_id):
+    job = get_job_or_404(current_user, job_id)
+    if job is None:
+        return jsonify({'error': 'Access forbidden'}), 403
+    if job.status != 'succeeded':
+        return jsonify({'error': f'Job is {job.status}', 'status': job.status}), 409
+    return Response(job.result or '', mimetype=job.result_type or 'application/octet-stream'), 200
+
+# Cancel a Job
+@api_bp.route('/jobs/<job_id>', methods=['DELETE'])
+@query_budget(4)
+@token_required
+def delete_job(current_user, job_id):
+    job = get_job_or_404(current_user, job_id)
+    if job is None:
+        return jsonify({'error': 'Access forbidden'}), 403
+    if not cancel_job(job):
+        return jsonify({'error': f'Job already {job.status}', 'status': job.status}), 409
+    return jsonify(job.to_dict()), 202
+
+MAX_CHANGES_PER_PAGE = 5000
+
+# Get Changes Since a Sequence Number
+# Insert and update entries carry the full row and should be applied as upserts
+@api_bp.route('/changes', methods=['GET'])
+@query_budget(4)
+@token_required
+def get_changes(current_user):
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), MAX_CHANGES_PER_PAGE)
+    entries, has_more = changes_since(since, limit)
+    return jsonify({
+        'changes': [entry.to_dict() for entry in entries],
+        'next': entries[-1].seq if entries else since,
+        'has_more': has_more
+    }), 200
+
+MAX_REPLAY_EVENTS = 10000
+SSE_HEARTBEAT_SECONDS = 15
+
+# Stream Project, Class, Cohort and Membership Changes (Server-Sent Events)
+# Filter with ?cohort_id= or ?class_id=; reconnecting clients resume from Last-Event-ID.
+# EventSource can't set Authorization, so browsers pass the JWT as ?access_token=.
+@api_bp.route('/events', methods=['GET'])
+@query_budget(3)
+@token_or_query_required
+def stream_events(current_user):
+    cohort_id = request.args.get('cohort_id', type=int)
+    class_id = request.args.get('class_id', type=int)
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        since = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an integer'}), 400
+
+    # Subscribe before replaying so nothing committed in between is missed
+    notifier = get_notifier(current_app._get_current_object())
+    subscription = Subscription(cohort_id, class_id)
+    last_seq = notifier.subscribe(subscription, current_app.config['SSE_MAX_SUBSCRIBERS'])
+    if last_seq is None:
+        return jsonify({'error': 'Too many event subscribers, try again later'}), 503
+    replay = []
+    if since is not None:
+        entries, has_more = changes_since(since, MAX_REPLAY_EVENTS)
+        if has_more:
+            # Too far behind to replay; the client should refetch and resume from here
+            last_seq = latest_seq()
+            replay = [f'id: {last_seq}\nevent: reset\ndata: {{}}\n\n']
+        else:
+            replay = [format_event(event) for event in notifier.to_events(entries) if subscription.matches(event)]
+            last_seq = entries[-1].seq if entries else since
+    db.session.remove()
+
+    def generate(last_seq):
+        try:
+            yield 'retry: 3000\n\n'
+            yield from replay
+            while not subscription.closed:
+                try:
+                    event = subscription.queue.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event['seq'] > last_seq:
+                    last_seq = event['seq']
+                    yield format_event(event)
+        finally:
+            notifier.unsubscribe(subscription)
+
+    response = Response(generate(last_seq), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # generate()'s finally only runs once the body is iterated; a response that's closed
+    # without being sent (client gone before the first byte) must let go of its slot too
+    response.call_on_close(lambda: notifier.unsubscribe(subscription))
+    return response
@@ -0,0 +1,57 @@
+import time
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'primary_until'
+PIN_HEADER = 'X-Primary-Until'
+
+class RoutingSession(Session):
+    """Sends default-bind reads to the replica engine while the request is routed there.
+
+    Flushes always go to the primary, and binds other than the default
+    (e.g. jobs) are left alone.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and not self._flushing and has_app_context() and g.get('db_route') == REPLICA_BIND:
+            engines = self._db.engines
+            if REPLICA_BIND in engines and engine is engines.get(None):
+                return engines[REPLICA_BIND]
+        return engine
+
+def pinned_until():
+    """When the client's read-your-writes window ends, from its cookie or echoed header."""
+    value = request.headers.get(PIN_HEADER) or request.cookies.get(PIN_COOKIE)
+    try:
+        return float(value) if value else 0
+    except ValueError:
+        return 0
+
+def route_request(engines):
+    """Route this request's reads to the replica unless it writes or the client just wrote.
+
+    Sub-requests of a /batch share its g; once one of them has written
+    (g.batch_wrote), the rest keep the primary route.
+    """
+    if g.get('batch_wrote'):
+        g.db_route = 'primary'
+        return
+    use_replica = REPLICA_BIND in engines and request.method in READ_METHODS and pinned_until() <= time.time()
+    g.db_route = REPLICA_BIND if use_replica else 'primary'
+
+def skip_pin():
+    """Leave the client unpinned after a write request that turned out to change nothing."""
+    g.skip_pin = True
+
+def pin_to_primary(response, engines, window):
+    """After a successful write, keep the client on the primary until the replica has caught up."""
+    if REPLICA_BIND not in engines:
+        return response
+    if request.method not in READ_METHODS and response.status_code < 400 and window > 0 and not g.get('skip_pin'):
+        until = int(time.time() + window)
+        response.set_cookie(PIN_COOKIE, str(until), max_age=window, httponly=True, samesite='Lax')
+        response.headers[PIN_HEADER] = str(until)
+    return response
@@ -0,0 +1,275 @@
+import re
+from functools import wraps
+from flask import jsonify, request
+from jobs import EXPORT_TABLES
+
+MAX_MEMBERS_PER_REQUEST = 1000
+MAX_BATCH_REQUESTS = 20
+
+class ValidationError(ValueError):
+    """A request body that doesn't fit its schema; path leads to the offending value."""
+
+    def __init__(self, message, path=()):
+        super().__init__(message)
+        self.message = message
+        self.path = path
+
+    def __str__(self):
+        where = ''.join(f'[{key}]' if isinstance(key, int) else f'.{key}' for key in self.path)
+        where = where[1:] if where.startswith('.') else 'body' + where
+        return f'{where}: {self.message}'
+
+class Unset:
+    """Value of an optional field the client left out, so updates can tell it from null."""
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'UNSET'
+
+UNSET = Unset()
+
+# How each JSON type is named in error messages
+JSON_TYPES = {str: 'a string', int: 'an integer', bool: 'true or false', list: 'an array', dict: 'an object'}
+# Integer fields also take ids sent as strings, e.g. "role_id": "2", like the routes always have
+INTEGER_STRING = re.compile(r'-?[0-9]+')
+
+def decode_items(decode_item, items, path):
+    decoded = []
+    for index, item in enumerate(items):
+        try:
+            decoded.append(decode_item(item))
+        except ValidationError as e:
+            raise ValidationError(e.message, path + (index,) + e.path) from None
+    return decoded
+
+def compile_function(name, param, lines, constants):
+    """Build def name(param) from its (indented) body lines, which may refer to constants by name."""
+    namespace = {'ValidationError': ValidationError, 'UNSET': UNSET, 'decode_items': decode_items, **constants}
+    exec(compile('\n'.join([f'def {name}({param}):'] + lines), f'<schema {name}>', 'exec'), namespace)
+    return namespace[name]
+
+class Field:
+    """One key of a Schema: its JSON type (None for any), presence, nullability and limits.
+
+    items (a Schema or a Field) decodes each item of an array. Fields aren't
+    interpreted per request: their checks are written out as straight-line
+    Python source and compiled once, into check() here and into the decoder
+    of every Schema they're part of.
+    """
+
+    def __init__(self, type=None, *, required=True, default=UNSET, nullable=False,
+                 min_length=None, max_length=None, prefix=None, choices=None, items=None):
+        self.type = type
+        self.required = required
+        self.default = default
+        self.nullable = nullable
+        self.min_length = min_length
+        self.max_length = max_length
+        self.prefix = prefix
+        self.choices = choices
+        self.items = items
+        constants = {}
+        self.check = compile_function('check', 'value', self.source('value', (), constants) + ['    return value'],
+                                      constants)
+
+    def source(self, var, path, constants):
+        """Lines checking (and for arrays of items, decoding) var in place; errors point at path."""
+        def constant(value):
+            key = f'c{len(constants)}'
+            constants[key] = value
+            return key
+
+        def fail(message):
+            return f'    raise ValidationError({message!r}, {path!r})'
+
+        # Strings are measured in characters, arrays in items
+        at_least, at_most = ('must have at least {} items', 'must have at most {} items') if self.type is list \
+            else ('must be at least {} characters long', 'must be at most {} characters long')
+        checks = []
+        if self.type is int:
+            # type() rather than isinstance(), so true isn't taken for an integer
+            checks += [f'if type({var}) is not int:',
+                       f'    if type({var}) is not str or not {constant(INTEGER_STRING.fullmatch)}({var}):',
+                       '    ' + fail('must be an integer'),
+                       f'    {var} = int({var})']
+        elif self.type is not None:
+            checks += [f'if type({var}) is not {constant(self.type)}:', fail(f'must be {JSON_TYPES[self.type]}')]
+        if self.min_length is not None:
+            checks += [f'if len({var}) < {self.min_length}:', fail(at_least.format(self.min_length))]
+        if self.max_length is not None:
+            checks += [f'if len({var}) > {self.max_length}:', fail(at_most.format(self.max_length))]
+        if self.prefix is not None:
+            checks += [f'if not {var}.startswith({self.prefix!r}):', fail(f'must start with "{self.prefix}"')]
+        if self.choices is not None:
+            checks += [f'if {var} not in {constant(frozenset(self.choices))}:',
+                       fail(f'must be one of {", ".join(self.choices)}')]
+        if self.items is not None:
+            decode_item = self.items.decode if isinstance(self.items, type) else self.items.check
+            checks += [f'{var} = decode_items({constant(decode_item)}, {var}, {path!r})']
+
+        lines = [f'if {var} is None:', '    pass' if self.nullable else fail('must not be null')]
+        if checks:
+            lines += ['else:'] + ['    ' + line for line in checks]
+        return ['    ' + line for line in lines]
+
+class Schema:
+    """A JSON object body, its keys declared as Field class attributes.
+
+    Each subclass is compiled into its own decode() when it's defined, which
+    checks a parsed body in one pass and returns an instance with one
+    attribute per field (its default, UNSET unless given, when the client
+    left it out). Undeclared keys are ignored.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = [(name, field) for name, field in vars(cls).items() if isinstance(field, Field)]
+        constants = {'cls': cls, 'new': object.__new__}
+        lines = ['    if type(data) is not dict:',
+                 "        raise ValidationError('must be an object')",
+                 '    get = data.get']
+        for index, (name, field) in enumerate(fields):
+            var = f'v{index}'
+            lines += [f'    {var} = get({name!r}, UNSET)', f'    if {var} is UNSET:']
+            if field.required:
+                lines.append(f"        raise ValidationError('is required', {(name,)!r})")
+            else:
+                constants[f'd{index}'] = field.default
+                lines.append(f'        {var} = d{index}')
+            lines += ['    else:'] + ['    ' + line for line in field.source(var, (name,), constants)]
+        lines += ['    body = new(cls)',
+                  '    body.__dict__.update({' + ', '.join(f'{name!r}: v{index}' for index, (name, _) in enumerate(fields)) + '})',
+                  '    return body']
+        cls.decode = staticmethod(compile_function('decode', 'data', lines, constants))
+
+    def to_dict(self):
+        """The fields that have a value, leaving out the UNSET ones."""
+        return {name: value for name, value in vars(self).items() if value is not UNSET}
+
+class ListOf:
+    """A JSON array body of item (a Schema or a Field).
+
+    With single=True a lone item is accepted too and decoded as just that item.
+    """
+
+    def __init__(self, item, *, min_items=None, max_items=None, single=False):
+        self.item = item
+        self.single = single
+        self.check = Field(list, min_length=min_items, max_length=max_items, items=item).check
+
+    def decode(self, data):
+        if self.single and type(data) is dict:
+            return self.item.decode(data)
+        return self.check(data)
+
+def validate_body(schema, optional=False):
+    """Decode the JSON body with schema and hand it to the route as body=.
+
+    Goes below @token_required/@role_required, so only callers allowed to use
+    the route learn about its schema, and above @idempotent: a malformed body
+    is answered with a 400 before a key is claimed or the route runs a query.
+    Open routes put it right below @query_budget. With optional=True a
+    missing or unparsable body decodes like {}.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            try:
+                kwargs['body'] = schema.decode({} if data is None and optional else data)
+            except ValidationError as e:
+                return jsonify({'error': 'Invalid request body', 'details': str(e)}), 400
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Register / Login
+class RegisterBody(Schema):
+    username = Field(str, min_length=1, max_length=80)
+    email = Field(str, min_length=1, max_length=120)
+    password = Field(str, min_length=1)
+    role_id = Field(int)
+
+class LoginBody(Schema):
+    email = Field(str, min_length=1)
+    password = Field(str, min_length=1)
+
+# Projects, limited like the Project columns and validators
+PROJECT_NAME = dict(min_length=7, max_length=120)
+PROJECT_DESCRIPTION = dict(min_length=20, max_length=500)
+GITHUB_LINK = dict(prefix='https://github.com/', max_length=200)
+
+class NewProjectBody(Schema):
+    name = Field(str, **PROJECT_NAME)
+    description = Field(str, **PROJECT_DESCRIPTION)
+    github_link = Field(str, **GITHUB_LINK)
+    owner_id = Field(int)
+    class_id = Field(int)
+    poster_url = Field(str, required=False, nullable=True, default='')
+
+class ClassProjectBody(Schema):
+    name = Field(str, **PROJECT_NAME)
+    description = Field(str, **PROJECT_DESCRIPTION)
+    github_link = Field(str, **GITHUB_LINK)
+    owner_id = Field(int)
+    poster_url = Field(str, min_length=1)
+
+class ProjectUpdateBody(Schema):
+    name = Field(str, required=False, **PROJECT_NAME)
+    description = Field(str, required=False, **PROJECT_DESCRIPTION)
+    github_link = Field(str, required=False, **GITHUB_LINK)
+    poster_url = Field(str, required=False, nullable=True)
+    class_id = Field(int, required=False)
+    owner_id = Field(int, required=False)
+
+# Cohorts and classes
+class CohortClassBody(Schema):
+    name = Field(str, min_length=1, max_length=80)
+    description = Field(str, required=False, nullable=True, default=None, max_length=200)
+
+class NewCohortBody(Schema):
+    name = Field(str, min_length=1, max_length=80)
+    description = Field(str, required=False, nullable=True, default=None, max_length=200)
+    classes = Field(list, required=False, default=(), items=CohortClassBody)
+
+class ClassUpdateBody(Schema):
+    id = Field(int, required=False)
+    name = Field(str, required=False, min_length=1, max_length=80)
+    description = Field(str, required=False, nullable=True, max_length=200)
+
+class CohortUpdateBody(Schema):
+    name = Field(str, required=False, min_length=1, max_length=80)
+    description = Field(str, required=False, nullable=True, max_length=200)
+    classes = Field(list, required=False, default=(), items=ClassUpdateBody)
+
+class NewClassBody(Schema):
+    name = Field(str, min_length=1, max_length=80)
+    description = Field(str, required=False, nullable=True, default=None, max_length=200)
+    cohort_id = Field(int)
+
+# Project members: one pair or a list of them
+class MemberBody(Schema):
+    project_id = Field(int)
+    user_id = Field(int)
+
+MembersBody = ListOf(MemberBody, min_items=1, max_items=MAX_MEMBERS_PER_REQUEST, single=True)
+
+# Batch
+class SubRequestBody(Schema):
+    method = Field(str, required=False, default='GET')
+    path = Field(str)
+    body = Field(required=False, nullable=True, default=None)
+
+class BatchBody(Schema):
+    requests = Field(list, min_length=1, max_length=MAX_BATCH_REQUESTS, items=SubRequestBody)
+
+# Jobs; imported rows are checked one by one by the job, which reports each bad line
+class ExportBody(Schema):
+    tables = Field(list, required=False, default=EXPORT_TABLES, min_length=1, items=Field(str, choices=EXPORT_TABLES))
+
+class BackupBody(Schema):
+    compress = Field(bool, required=False, default=True)
+
+ImportUsersBody = ListOf(Field(dict))
@@ -0,0 +1,111 @@
+import gc
+import os
+from gunicorn.app.base import BaseApplication
+
+# Workload hints and the worker class they map to
+WORKLOADS = ('cpu', 'io', 'mixed')
+
+def autotune(workload=None, cpu_count=None):
+    """Pick worker count, worker class and threads from the CPU count and a workload hint."""
+    workload = (workload or os.environ.get('WEB_WORKLOAD') or 'mixed').lower()
+    if workload not in WORKLOADS:
+        raise ValueError(f'Unknown workload {workload!r}, expected one of {", ".join(WORKLOADS)}')
+    cpus = cpu_count or os.cpu_count() or 1
+
+    if workload == 'cpu':
+        # Password hashing and serialization: one process per core, threads would only fight over the GIL
+        workers, worker_class, threads = cpus + 1, 'sync', 1
+    elif workload == 'io':
+        # Mostly waiting on SQLite and the network: fewer processes, more threads each
+        workers, worker_class, threads = cpus + 1, 'gthread', 4
+    else:
+        workers, worker_class, threads = 2 * cpus + 1, 'gthread', 2
+
+    # Explicit overrides win over the autotuned values
+    workers = int(os.environ.get('WEB_CONCURRENCY', workers))
+    threads = int(os.environ.get('WEB_THREADS', threads))
+    if threads > 1:
+        worker_class = 'gthread'
+    max_workers = int(os.environ.get('WEB_MAX_WORKERS', 12))
+    return {
+        'workers': max(1, min(workers, max_workers)),
+        'worker_class': worker_class,
+        'threads': threads,
+    }
+
+def warm_caches(app):
+    """Load everything a first request would load lazily, so forked workers inherit it."""
+    from sqlalchemy.orm import configure_mappers
+    from app import db
+    from models import User, Role, Project, Cohort, Class, ProjectMember
+
+    configure_mappers()
+    with app.app_context():
+        # Compile the common SELECTs and pull the hot pages into the OS cache
+        for model in (Role, User, Cohort, Class, Project, ProjectMember):
+            model.query.limit(1).all()
+        db.session.remove()
+        # Never hand an open SQLite connection across fork()
+        for engine in db.engines.values():
+            engine.dispose()
+
+    # Walk the request path once so Werkzeug/Flask finish their lazy imports
+    app.test_client().get('/api/test')
+
+def when_ready(server):
+    """Runs in the master after the app is preloaded and before any worker is forked."""
+    warm_caches(server.app.wsgi())
+    # Move every object that survived import into the permanent generation. The
+    # collector never touches them again, so the refcount/GC header writes that
+    # used to un-share copy-on-write pages in each worker go away.
+    gc.collect()
+    gc.freeze()
+
+def post_fork(server, worker):
+    """Drop pooled connections inherited from the master, fit the event stream cap to the
+    worker's threads, pick up jobs orphaned by dead workers and start the idle-time maintenance thread."""
+    from app import db
+    from jobs import get_executor
+    from maintenance import start_scheduler
+
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    # Every open /api/events stream holds one of the worker's threads, so streams
+    # may take all but one of them and ordinary requests always have a thread left
+    app.config['SSE_MAX_SUBSCRIBERS'] = min(app.config['SSE_MAX_SUBSCRIBERS'], worker.cfg.threads - 1)
+    get_executor(app)
+    start_scheduler(app)
+
+def gunicorn_options(workload=None, bind=None, **overrides):
+    """Full gunicorn configuration for serving the preloaded app."""
+    options = {
+        'bind': bind or f"0.0.0.0:{os.environ.get('PORT', '8000')}",
+        'preload_app': True,
+        'when_ready': when_ready,
+        'post_fork': post_fork,
+        'timeout': int(os.environ.get('WEB_TIMEOUT', 30)),
+        'max_requests': int(os.environ.get('WEB_MAX_REQUESTS', 0)),
+        'max_requests_jitter': int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0)),
+        'accesslog': '-',
+    }
+    options.update(autotune(workload))
+    options.update({key: value for key, value in overrides.items() if value is not None})
+    return options
+
+class ServeApplication(BaseApplication):
+    """Gunicorn application that serves an already-created Flask app."""
+
+    def __init__(self, application, options=None):
+        self.application = application
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key.lower(), value)
+
+    def load(self):
+        return self.application
@@ -0,0 +1,254 @@
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+from app import db
+from models import User, Role, Cohort, Class, Project, ProjectMember
+
+# Keep IN lists well under SQLite's bound-parameter limit
+IN_CHUNK_SIZE = 500
+
+def chunks(items, size=IN_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def utcnow():
+    return datetime.datetime.utcnow()
+
+def tombstone(query, model, stamp):
+    """Set deleted_at on the live rows of a bulk query; rows deleted together share the stamp."""
+    return query.filter(model.deleted_at.is_(None)) \
+        .update({model.deleted_at: stamp}, synchronize_session=False)
+
+def delete_users(user_ids, reassign_to_email=None):
+    """Delete users in one transaction, handing their projects to the reassignment user.
+
+    Users and their memberships are tombstoned, not removed. Returns the
+    sorted IDs that were actually deleted. Raises ValueError if the
+    reassignment user does not exist or is one of the users being deleted.
+    """
+    user_ids = {int(user_id) for user_id in user_ids}
+    email = reassign_to_email or current_app.config['REASSIGN_OWNER_EMAIL']
+
+    target_id = db.session.query(User.id).filter_by(email=email).scalar()
+    if target_id is None:
+        raise ValueError(f'Reassignment user {email} not found')
+    if target_id in user_ids:
+        raise ValueError(f'Cannot reassign projects to {email}, it is being deleted')
+
+    deleted = []
+    stamp = utcnow()
+    try:
+        for batch in chunks(user_ids):
+            deleted.extend(user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(batch)))
+            # Tombstoned projects too, so the purge never leaves a project pointing at a removed user.
+            # Bulk UPDATEs skip version_id_col, so the version is bumped by hand for If-Match
+            db.session.query(Project).filter(Project.owner_id.in_(batch)) \
+                .update({Project.owner_id: target_id, Project.version: Project.version + 1},
+                        synchronize_session=False)
+            tombstone(db.session.query(ProjectMember).filter(ProjectMember.user_id.in_(batch)), ProjectMember, stamp)
+            tombstone(db.session.query(User).filter(User.id.in_(batch)), User, stamp)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return sorted(deleted)
+
+def delete_project_tree(project_id):
+    """Tombstone a project and its memberships in one transaction."""
+    stamp = utcnow()
+    try:
+        tombstone(db.session.query(ProjectMember).filter_by(project_id=project_id), ProjectMember, stamp)
+        tombstone(db.session.query(Project).filter_by(id=project_id), Project, stamp)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+def tombstone_classes(class_ids, stamp):
+    """Tombstone classes with their projects and memberships; the caller commits.
+
+    Children go first, like real deletes, so the stats triggers see the same order.
+    """
+    project_ids = db.session.query(Project.id).filter(Project.class_id.in_(class_ids)).scalar_subquery()
+    tombstone(db.session.query(ProjectMember).filter(ProjectMember.project_id.in_(project_ids)),
+              ProjectMember, stamp)
+    tombstone(db.session.query(Project).filter(Project.class_id.in_(class_ids)), Project, stamp)
+    tombstone(db.session.query(Class).filter(Class.id.in_(class_ids)), Class, stamp)
+
+def delete_cohort_tree(cohort_id):
+    """Tombstone a cohort with its classes, their projects and memberships in one transaction.
+
+    A fixed number of bulk UPDATEs however big the cohort is; the delete_cohort
+    job does the same one class per transaction for cohorts too big for a request.
+    """
+    stamp = utcnow()
+    try:
+        tombstone_classes(db.session.query(Class.id).filter_by(cohort_id=cohort_id).scalar_subquery(), stamp)
+        tombstone(db.session.query(Cohort).filter_by(id=cohort_id), Cohort, stamp)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+# Tombstoned trees, parents first: (model, parent model, column pointing at the parent)
+RESTORE_TREES = {
+    User: ((ProjectMember, User, 'user_id'),),
+    Cohort: ((Class, Cohort, 'cohort_id'), (Project, Class, 'class_id'), (ProjectMember, Project, 'project_id')),
+    Project: ((ProjectMember, Project, 'project_id'),),
+}
+
+def restore_deleted(model, row_id):
+    """Undo the delete of a user, cohort or project that hasn't been purged yet.
+
+    Brings back the rows deleted along with it, i.e. those with the same
+    deleted_at stamp; a deleted user's projects stay with the user they were
+    handed to. Returns {table: rows restored}. Raises ValueError if the row
+    isn't deleted or a restored row clashes with one created since.
+    """
+    stamp = db.session.query(model.deleted_at).filter(model.id == row_id) \
+        .execution_options(include_deleted=True).scalar()
+    if stamp is None:
+        raise ValueError(f'{model.__tablename__} {row_id} is not deleted')
+
+    restored = {}
+    try:
+        restored[model.__tablename__] = db.session.query(model).filter(model.id == row_id) \
+            .update({model.deleted_at: None}, synchronize_session=False)
+        for child, parent, column in RESTORE_TREES[model]:
+            # Only the restored parents are live and share the stamp with their children
+            parent_ids = db.session.query(parent.id).filter(parent.deleted_at.is_(None)).scalar_subquery()
+            restored[child.__tablename__] = db.session.query(child) \
+                .filter(child.deleted_at == stamp, getattr(child, column).in_(parent_ids)) \
+                .update({child.deleted_at: None}, synchronize_session=False)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        raise ValueError(f'{model.__tablename__} {row_id} clashes with a row created since it was deleted') from e
+    except Exception:
+        db.session.rollback()
+        raise
+    return restored
+
+# Tombstones removed per transaction; each batch holds the write lock only briefly
+PURGE_BATCH_SIZE = 500
+
+# Children first, so no purged row leaves a live or tombstoned row pointing at it
+PURGE_ORDER = (ProjectMember, Project, Class, Cohort, User)
+
+def purge_deleted(older_than, batch_size=PURGE_BATCH_SIZE, max_batches=None):
+    """Physically delete rows tombstoned before older_than, batch_size rows per transaction.
+
+    Stops after max_batches batches when given, so callers can bound the
+    work done in one go. Returns {table: rows purged}.
+    """
+    purged = {model.__tablename__: 0 for model in PURGE_ORDER}
+    batches = 0
+    for model in PURGE_ORDER:
+        while max_batches is None or batches < max_batches:
+            ids = [row_id for (row_id,) in db.session.query(model.id)
+                   .filter(model.deleted_at.isnot(None), model.deleted_at < older_than)
+                   .execution_options(include_deleted=True).limit(batch_size)]
+            if not ids:
+                break
+            db.session.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            purged[model.__tablename__] += len(ids)
+            batches += 1
+    return purged
+
+def purge_cutoff(days):
+    return utcnow() - datetime.timedelta(days=days)
+
+IMPORT_FIELDS = ('username', 'email', 'password', 'role')
+
+def import_users(rows, batch_size=500, workers=None, progress=None):
+    """Bulk-create users from dicts with username, email, password and role.
+
+    Roles are resolved with one query, existing users are checked a batch at a
+    time, passwords are hashed across a process pool and users are inserted
+    one batch per statement. progress(done, total) is called after each batch.
+    Returns {'created': n, 'skipped': n, 'failed': [(line_no, reason), ...]}.
+    """
+    created, skipped, failed = 0, 0, []
+
+    # Validate rows and drop in-file duplicates before touching the database
+    valid, seen_emails, seen_usernames = [], set(), set()
+    for line_no, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            failed.append((line_no, 'not an object'))
+            continue
+        missing = [field for field in IMPORT_FIELDS if not row.get(field)]
+        # JSON rows can hold any type; only strings can be hashed, compared and stored
+        mistyped = [field for field in IMPORT_FIELDS if field not in missing and not isinstance(row[field], str)]
+        if missing:
+            failed.append((line_no, f'missing {", ".join(missing)}'))
+        elif mistyped:
+            failed.append((line_no, f'{", ".join(mistyped)} must be a string'))
+        elif row['email'] in seen_emails or row['username'] in seen_usernames:
+            skipped += 1
+        else:
+            seen_emails.add(row['email'])
+            seen_usernames.add(row['username'])
+            valid.append((line_no, row))
+
+    # One query for every role name in the file
+    role_names = {row['role'] for _, row in valid}
+    role_ids = dict(db.session.query(Role.name, Role.id).filter(Role.name.in_(role_names)))
+
+    # Existing users, checked a batch of emails/usernames at a time
+    taken_emails, taken_usernames = set(), set()
+    for batch in chunks(valid, batch_size):
+        emails = [row['email'] for _, row in batch]
+        usernames = [row['username'] for _, row in batch]
+        for email, username in db.session.query(User.email, User.username).filter(
+                User.email.in_(emails) | User.username.in_(usernames)):
+            taken_emails.add(email)
+            taken_usernames.add(username)
+
+    pending = []
+    for line_no, row in valid:
+        if row['email'] in taken_emails or row['username'] in taken_usernames:
+            skipped += 1
+        elif row['role'] not in role_ids:
+            failed.append((line_no, f"role {row['role']} not found"))
+        else:
+            pending.append((line_no, row))
+
+    # Hashing dominates the runtime, so spread it over every core (or the given number of
+    # processes). Spawned rather than forked: the caller may be a threaded web worker
+    # holding open SQLite connections, which a forked child must never inherit
+    if pending:
+        pool_size = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=pool_size, mp_context=get_context('spawn')) as pool:
+            hashes = pool.map(generate_password_hash, (row['password'] for _, row in pending),
+                              chunksize=max(1, len(pending) // (4 * pool_size)))
+            records = [{
+                'username': row['username'],
+                'email': row['email'],
+                'password_hash': password_hash,
+                'role_id': role_ids[row['role']],
+            } for (_, row), password_hash in zip(pending, hashes)]
+    else:
+        records = []
+
+    done = 0
+    for batch_rows, batch in zip(chunks(pending, batch_size), chunks(records, batch_size)):
+        try:
+            db.session.execute(insert(User), batch)
+            db.session.commit()
+            created += len(batch)
+        except Exception as e:
+            db.session.rollback()
+            failed.extend((line_no, e.__class__.__name__) for line_no, _ in batch_rows)
+        done += len(batch)
+        if progress:
+            progress(done, len(pending))
+
+    return {'created': created, 'skipped': skipped, 'failed': sorted(failed)}
@@ -0,0 +1,159 @@
+from sqlalchemy import func
+from app import db
+from triggers import sync_triggers
+from models import User, Project, Cohort, Class, ProjectMember, StatCounter
+
+# Totals are stored under ref_id 0, everything else under the owning row's id
+TOTAL_KINDS = ('users', 'cohorts', 'classes', 'projects', 'project_members')
+COHORT_KINDS = ('cohort_classes', 'cohort_projects')
+CLASS_KINDS = ('class_projects', 'class_members')
+PROJECT_KINDS = ('project_members',)
+
+def _bump(kind, ref, delta):
+    # A row whose parent doesn't exist has no parent counter to move; without the WHERE
+    # the NULL ref_id would fail the whole write. (The WHERE also keeps SQLite from
+    # parsing ON CONFLICT as a join constraint of the SELECT.)
+    return (f"INSERT INTO stat_counter (kind, ref_id, value) SELECT '{kind}', {ref}, {delta} WHERE {ref} IS NOT NULL "
+            f"ON CONFLICT (kind, ref_id) DO UPDATE SET value = value + ({delta});")
+
+def _counter(kind, ref):
+    return f"COALESCE((SELECT value FROM stat_counter WHERE kind = '{kind}' AND ref_id = {ref}), 0)"
+
+def _drop(kind, ref):
+    return f"DELETE FROM stat_counter WHERE kind = '{kind}' AND ref_id = {ref};"
+
+def _cohort_of(class_ref):
+    return f'(SELECT cohort_id FROM class WHERE id = {class_ref})'
+
+def _class_of(project_ref):
+    return f'(SELECT class_id FROM project WHERE id = {project_ref})'
+
+# SQLite triggers run inside the writing statement's transaction, so the
+# counters move atomically with ORM flushes, bulk INSERTs and set-based
+# UPDATE/DELETEs alike.
+TRIGGERS = {
+    'stat_user_insert': ('AFTER INSERT ON user', [_bump('users', 0, 1)]),
+    'stat_user_delete': ('AFTER DELETE ON user', [_bump('users', 0, -1)]),
+    'stat_cohort_insert': ('AFTER INSERT ON cohort', [_bump('cohorts', 0, 1)]),
+    'stat_cohort_delete': ('AFTER DELETE ON cohort', [
+        _bump('cohorts', 0, -1),
+        _drop('cohort_classes', 'OLD.id'),
+        _drop('cohort_projects', 'OLD.id'),
+    ]),
+    'stat_class_insert': ('AFTER INSERT ON class', [
+        _bump('classes', 0, 1),
+        _bump('cohort_classes', 'NEW.cohort_id', 1),
+    ]),
+    'stat_class_delete': ('AFTER DELETE ON class', [
+        _bump('classes', 0, -1),
+        _bump('cohort_classes', 'OLD.cohort_id', -1),
+        _bump('cohort_projects', 'OLD.cohort_id', '-' + _counter('class_projects', 'OLD.id')),
+        _drop('class_projects', 'OLD.id'),
+        _drop('class_members', 'OLD.id'),
+    ]),
+    'stat_class_move': ('AFTER UPDATE OF cohort_id ON class WHEN OLD.cohort_id IS NOT NEW.cohort_id', [
+        _bump('cohort_classes', 'OLD.cohort_id', -1),
+        _bump('cohort_classes', 'NEW.cohort_id', 1),
+        _bump('cohort_projects', 'OLD.cohort_id', '-' + _counter('class_projects', 'NEW.id')),
+        _bump('cohort_projects', 'NEW.cohort_id', _counter('class_projects', 'NEW.id')),
+    ]),
+    'stat_project_insert': ('AFTER INSERT ON project', [
+        _bump('projects', 0, 1),
+        _bump('class_projects', 'NEW.class_id', 1),
+        _bump('cohort_projects', _cohort_of('NEW.class_id'), 1),
+    ]),
+    'stat_project_delete': ('AFTER DELETE ON project', [
+        _bump('projects', 0, -1),
+        _bump('class_projects', 'OLD.class_id', -1),
+        _bump('cohort_projects', _cohort_of('OLD.class_id'), -1),
+        _bump('class_members', 'OLD.class_id', '-' + _counter('project_members', 'OLD.id')),
+        _drop('project_members', 'OLD.id'),
+    ]),
+    'stat_project_move': ('AFTER UPDATE OF class_id ON project WHEN OLD.class_id IS NOT NEW.class_id', [
+        _bump('class_projects', 'OLD.class_id', -1),
+        _bump('class_projects', 'NEW.class_id', 1),
+        _bump('cohort_projects', _cohort_of('OLD.class_id'), -1),
+        _bump('cohort_projects', _cohort_of('NEW.class_id'), 1),
+        _bump('class_members', 'OLD.class_id', '-' + _counter('project_members', 'NEW.id')),
+        _bump('class_members', 'NEW.class_id', _counter('project_members', 'NEW.id')),
+    ]),
+    'stat_member_insert': ('AFTER INSERT ON project_member', [
+        _bump('project_members', 0, 1),
+        _bump('project_members', 'NEW.project_id', 1),
+        _bump('class_members', _class_of('NEW.project_id'), 1),
+    ]),
+    'stat_member_delete': ('AFTER DELETE ON project_member', [
+        _bump('project_members', 0, -1),
+        _bump('project_members', 'OLD.project_id', -1),
+        _bump('class_members', _class_of('OLD.project_id'), -1),
+    ]),
+    'stat_member_move': ('AFTER UPDATE OF project_id ON project_member WHEN OLD.project_id IS NOT NEW.project_id', [
+        _bump('project_members', 'OLD.project_id', -1),
+        _bump('project_members', 'NEW.project_id', 1),
+        _bump('class_members', _class_of('OLD.project_id'), -1),
+        _bump('class_members', _class_of('NEW.project_id'), 1),
+    ]),
+}
+
+# Tombstoning a row counts as deleting it and clearing deleted_at as inserting it
+# again, so the purge physically removing a tombstone must not count a second time.
+# Trees are tombstoned children first and restored parents first, like real deletes and inserts.
+SOFT_DELETE_TABLES = {'user': 'user', 'cohort': 'cohort', 'class': 'class', 'project': 'project',
+                      'member': 'project_member'}
+for name, table in SOFT_DELETE_TABLES.items():
+    event, statements = TRIGGERS[f'stat_{name}_delete']
+    TRIGGERS[f'stat_{name}_delete'] = (f'{event} WHEN OLD.deleted_at IS NULL', statements)
+    TRIGGERS[f'stat_{name}_tombstone'] = (
+        f'AFTER UPDATE OF deleted_at ON {table} WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL',
+        statements)
+    TRIGGERS[f'stat_{name}_restore'] = (
+        f'AFTER UPDATE OF deleted_at ON {table} WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL',
+        TRIGGERS[f'stat_{name}_insert'][1])
+
+def install_stat_triggers():
+    """Create the counter triggers, seeding the counters whenever the triggers change."""
+    if sync_triggers('stat_', TRIGGERS):
+        # Triggers and seed land in the same transaction, so no write can slip between them
+        write_counters(compute_counters())
+    db.session.commit()
+
+def compute_counters():
+    """Recompute every counter from the live rows of the base tables with GROUP BY scans."""
+    counters = {
+        ('users', 0): db.session.query(func.count(User.id)).scalar(),
+        ('cohorts', 0): db.session.query(func.count(Cohort.id)).scalar(),
+        ('classes', 0): db.session.query(func.count(Class.id)).scalar(),
+        ('projects', 0): db.session.query(func.count(Project.id)).scalar(),
+        ('project_members', 0): db.session.query(func.count(ProjectMember.id)).scalar(),
+    }
+    grouped = {
+        'cohort_classes': db.session.query(Class.cohort_id, func.count(Class.id)).group_by(Class.cohort_id),
+        'cohort_projects': db.session.query(Class.cohort_id, func.count(Project.id))
+            .join(Project, Project.class_id == Class.id).group_by(Class.cohort_id),
+        'class_projects': db.session.query(Project.class_id, func.count(Project.id)).group_by(Project.class_id),
+        'class_members': db.session.query(Project.class_id, func.count(ProjectMember.id))
+            .join(ProjectMember, ProjectMember.project_id == Project.id).group_by(Project.class_id),
+        'project_members': db.session.query(ProjectMember.project_id, func.count(ProjectMember.id))
+            .group_by(ProjectMember.project_id),
+    }
+    for kind, query in grouped.items():
+        for ref_id, value in query:
+            counters[(kind, ref_id)] = value
+    return counters
+
+def write_counters(counters):
+    """Replace the stored counters with the given ones."""
+    db.session.query(StatCounter).delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(StatCounter, [
+        {'kind': kind, 'ref_id': ref_id, 'value': value} for (kind, ref_id), value in counters.items()
+    ])
+
+def stored_counters():
+    """Every stored counter, ignoring zero rows so they compare equal to recomputed ones."""
+    return {(c.kind, c.ref_id): c.value for c in StatCounter.query.filter(StatCounter.value != 0)}
+
+def read_counters(kinds, ref_id=0):
+    """Read a handful of counters for one row by primary key."""
+    values = dict(db.session.query(StatCounter.kind, StatCounter.value)
+                  .filter(StatCounter.kind.in_(kinds), StatCounter.ref_id == ref_id))
+    return {kind: values.get(kind, 0) for kind in kinds}
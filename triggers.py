@@ -0,0 +1,25 @@
+from sqlalchemy import text
+from app import db
+
+def trigger_sql(name, event, statements):
+    return f"CREATE TRIGGER {name} {event} BEGIN {' '.join(statements)} END"
+
+def sync_triggers(prefix, triggers):
+    """Make the database's triggers named prefix* match the given {name: (event, statements)}.
+
+    Only triggers whose SQL changed are recreated. Runs in the current
+    transaction and returns True if anything changed; the caller commits.
+    """
+    wanted = {name: trigger_sql(name, event, statements) for name, (event, statements) in triggers.items()}
+    existing = {name: sql for name, sql in db.session.execute(
+        text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")) if name.startswith(prefix)}
+    if existing == wanted:
+        return False
+
+    for name in existing.keys() - wanted.keys():
+        db.session.execute(text(f'DROP TRIGGER {name}'))
+    for name, sql in wanted.items():
+        if existing.get(name) != sql:
+            db.session.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+            db.session.execute(text(sql))
+    return True